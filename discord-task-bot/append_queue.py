@@ -0,0 +1,237 @@
+import asyncio
+import json
+import os
+import re
+from contextlib import asynccontextmanager
+
+import gspread
+
+from sheets_session import SheetsUnavailable
+from task_model import pad_row, same_task
+
+# ためた行を書き込む間隔（秒）と、待たずに書き込む件数
+APPEND_FLUSH_INTERVAL = float(os.environ.get('APPEND_FLUSH_INTERVAL', '2'))
+APPEND_BATCH_SIZE = int(os.environ.get('APPEND_BATCH_SIZE', '50'))
+# 未書き込みの行を保存しておくファイル（再起動しても失われないように）
+APPEND_SPOOL_PATH = os.environ.get('APPEND_SPOOL_PATH', 'pending_rows.json')
+# 書き込み失敗時の再試行間隔の上限（秒）
+APPEND_RETRY_MAX_DELAY = 60.0
+
+# append_rowsの応答の書き込んだ範囲（例: "'tasks'!A12:G14"）から先頭の行番号を取る
+UPDATED_RANGE_ROW = re.compile(r'![A-Z]+(\d+)')
+
+
+class AppendQueue:
+    """追加行をためて append_rows でまとめて書き込むライトビハインドキュー
+
+    put_many() した行はすぐにスプールファイルへ保存し、一定間隔または一定件数ごとに
+    1回の append_rows でシートへ書き込む（1回のput_many()の行は分けない）。
+    失敗した行はキューに残り、間隔を延ばしながら再試行する。
+    タイムアウトや5xxの時はシートに入っていることがあるので、送り直す前に
+    書き込まれたはずの位置を読んで、入っていた行はキューから外す。
+    """
+
+    def __init__(self, gateway, spool_path=APPEND_SPOOL_PATH,
+                 flush_interval=APPEND_FLUSH_INTERVAL, batch_size=APPEND_BATCH_SIZE):
+        self.gateway = gateway
+        self.spool_path = spool_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = self._load_spool()
+        # put_many()1回分ずつの行数（スプールから戻した行は1行ずつ）
+        self._groups = [1] * len(self._pending)
+        self._restored = bool(self._pending)
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._failures = 0
+        # 次の追記が入るはずの行番号（分からなければNone）
+        self._next_row = None
+        # 失敗したが書き込まれたかもしれない先頭の行数（0なら確認不要）
+        self._unconfirmed = 0
+        # 書き込んだ行が実際に入った位置 [(先頭の行番号, 行), ...]（take_landed()で取り出す）
+        self._landed = []
+
+    def pending_rows(self):
+        """まだシートに書き込まれていない行（追加順）"""
+        return list(self._pending)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        """バックグラウンドの書き込みタスクを開始（起動済みなら何もしない）"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+            if self._restored:
+                # 前回起動時に書き込めなかった行は待たずに書き込む
+                self._restored = False
+                self._wakeup.set()
+
+    def put_many(self, rows):
+        rows = [list(row) for row in rows]
+        if not rows:
+            return
+        self._pending.extend(rows)
+        self._groups.append(len(rows))
+        self._save_spool()
+        self.start()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """たまっている行をすべてシートに書き込む"""
+        async with self._lock:
+            await self._flush_locked()
+
+    async def close(self):
+        """書き込みタスクを止めて、たまっている行を書き込む（失敗した行はスプールに残る）"""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.wait([self._worker])
+            self._worker = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"❌ タスク書き込みエラー（{len(self._pending)}件はスプールに保存済み）: {e}")
+
+    @asynccontextmanager
+    async def paused(self):
+        """この中にいる間は書き込みを止める（シート全体の読み直しや書き換え用）"""
+        async with self._lock:
+            yield
+
+    def discard_pending(self):
+        """未書き込みの行を捨てる（シートを書き換えて反映済みの場合に使う）"""
+        self._pending.clear()
+        self._groups.clear()
+        self._landed.clear()
+        self._unconfirmed = 0
+        self._save_spool()
+
+    def set_sheet_rows(self, rows):
+        """シートの今の行数（ヘッダーを含む）を教える。paused()の中で呼ぶ
+
+        書き込みが失敗した時に、どこから読めば書き込まれたか確かめられるかの目安にする。
+        """
+        self._next_row = rows + 1
+
+    def take_landed(self):
+        """前回から書き込んだ行の位置 [(先頭の行番号, 行), ...] を返す
+
+        他からの追記が先に入ると、行はキューに入れた時の想定より後ろに入る。
+        応答から行番号が分からなければ先頭の行番号はNone。
+        """
+        landed, self._landed = self._landed, []
+        return landed
+
+    async def _flush_locked(self):
+        while self._pending:
+            if self._unconfirmed:
+                await self._confirm_locked()
+                continue
+            batch = self._pending[:self._next_batch_size()]
+            try:
+                response = await self.gateway.append_rows(batch)
+            except Exception as e:
+                if _may_have_landed(e):
+                    self._unconfirmed = len(batch)
+                raise
+            first_row = _first_row(response)
+            self._next_row = first_row + len(batch) if first_row is not None else None
+            self._drop(batch, first_row)
+            print(f"📝 {len(batch)}件のタスクをシートに書き込みました")
+
+    async def _confirm_locked(self):
+        """失敗した書き込みが実はシートに入っていたら、その行をキューから外す"""
+        # タイムアウトした呼び出しがまだ動いていると、読んだ後に書き込まれることがある
+        await self.gateway.settle()
+        batch = self._pending[:self._unconfirmed]
+        start = self._next_row or 2
+        tail = [pad_row(row) for row in (await self.gateway.batch_get([f'A{start}:G']))[0]]
+        self._unconfirmed = 0
+        self._next_row = start + len(tail)
+        for offset in range(len(tail) - len(batch) + 1):
+            if all(same_task(tail[offset + i], row) for i, row in enumerate(batch)):
+                self._drop(batch, start + offset)
+                print(f"📝 失敗したと思った書き込みは反映済みでした（{len(batch)}件）")
+                return
+
+    def _next_batch_size(self):
+        """次に書き込む行数（batch_size件ごと、ただし1回のput_many()の行は分けない）"""
+        count = 0
+        for size in self._groups:
+            if count and count + size > self.batch_size:
+                break
+            count += size
+        return count
+
+    def _drop(self, batch, first_row):
+        """シートに入った先頭の行をキューから外す"""
+        del self._pending[:len(batch)]
+        count = len(batch)
+        while count > 0 and self._groups:
+            count -= self._groups.pop(0)
+        self._landed.append((first_row, batch))
+        self._save_spool()
+
+    async def _run(self):
+        while True:
+            # wait_forは待機の完了と同時にキャンセルされるとキャンセルを
+            # 握りつぶすことがある（終了時に止まらなくなる）のでwaitで待つ
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait([waiter], timeout=self.flush_interval)
+            finally:
+                waiter.cancel()
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+            try:
+                await self.flush()
+                self._failures = 0
+            except Exception as e:
+                self._failures += 1
+                delay = min(self.flush_interval * 2 ** self._failures, APPEND_RETRY_MAX_DELAY)
+                print(f"❌ タスク書き込みエラー（{len(self._pending)}件保留、{delay:.0f}秒後に再試行）: {e}")
+                await asyncio.sleep(delay)
+
+    def _load_spool(self):
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return []
+        try:
+            with open(self.spool_path, encoding='utf-8') as f:
+                rows = json.load(f)
+            if rows:
+                print(f"📂 未書き込みのタスク{len(rows)}件を復元しました")
+            return rows
+        except (OSError, ValueError) as e:
+            print(f"⚠️ スプールファイル読み込みエラー: {e}")
+            return []
+
+    def _save_spool(self):
+        if not self.spool_path:
+            return
+        try:
+            tmp_path = self.spool_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._pending, f, ensure_ascii=False)
+            os.replace(tmp_path, self.spool_path)
+        except OSError as e:
+            print(f"⚠️ スプールファイル保存エラー: {e}")
+
+
+def _may_have_landed(error):
+    """書き込みに失敗しても、シートには入っているかもしれないエラーか（タイムアウト・5xx・通信エラー）"""
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.response.status_code >= 500
+    return not isinstance(error, SheetsUnavailable)
+
+
+def _first_row(response):
+    """append_rowsの応答から書き込んだ先頭の行番号を取る（分からなければNone）"""
+    try:
+        match = UPDATED_RANGE_ROW.search(response['updates']['updatedRange'])
+    except (KeyError, TypeError):
+        return None
+    return int(match.group(1)) if match else None
@@ -0,0 +1,221 @@
+"""コマンドのベンチマーク
+
+フェイクのワークシート（fake_sheets.py）に合成したタスクを入れて、
+各コマンドのハンドラーを直接呼び出し、シートの行数ごとに
+p50/p99レイテンシ・ピークメモリ・1回あたりのシート呼び出し回数を表示する。
+
+使用例：
+    python bench.py
+    python bench.py --sizes 1000,100000,1000000 --iterations 50 --latency 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+
+# main をimportする前に、ネットワークを使わない設定にしておく
+os.environ['SHEETS_FAKE'] = 'true'
+os.environ['TASK_STORAGE'] = 'sheets'
+os.environ['APPEND_SPOOL_PATH'] = ''
+os.environ.setdefault('NOTIFICATION_CHANNEL_ID', '1')
+# フェイクのシートには上限を付けないので、スケジューラーの待ちも無くす
+os.environ['SHEETS_READ_PER_MINUTE'] = '0'
+os.environ['SHEETS_WRITE_PER_MINUTE'] = '0'
+
+import main  # noqa: E402
+from digest import DigestEngine  # noqa: E402
+from fake_sheets import FakeWorksheet  # noqa: E402
+from sheets_session import HEADER  # noqa: E402
+from storage import create_storage  # noqa: E402
+from task_table import TaskTable  # noqa: E402
+
+DEFAULT_SIZES = '1000,10000,100000'
+
+
+class StubAuthor:
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.display_name = name
+
+
+class StubContext:
+    """コマンドに渡すctxの代わり（送信内容は捨てて件数だけ数える）"""
+
+    def __init__(self, author):
+        self.author = author
+        self.channel = None
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+    async def defer(self, **kwargs):
+        pass
+
+
+class StubChannel:
+    id = 1
+    guild = None
+
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class StubMessage:
+    content = 'yes'
+
+
+def generate_rows(size, users, seed=0):
+    """合成タスクを作る
+
+    ユーザーごとの件数は偏り（一部のユーザーが大半を登録）、
+    古い行ほど完了済みが多く、期限は今日の前後に散らばる。
+    """
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(users)]
+    user_ids = rng.choices(range(users), weights=weights, k=size)
+    today = datetime.now().date()
+    start = datetime.now() - timedelta(days=365)
+    rows = [list(HEADER)]
+    for i, user in enumerate(user_ids):
+        created = start + timedelta(seconds=i * 365 * 86400 // max(size, 1))
+        done = rng.random() < 0.9 * (1 - i / size)
+        due = ''
+        if rng.random() < 0.7:
+            due = (today + timedelta(days=int(rng.gauss(5, 15)))).strftime('%Y-%m-%d')
+        rows.append([
+            f'タスク{i}',
+            created.strftime('%Y/%m/%d %H:%M:%S'),
+            'TRUE' if done else 'FALSE',
+            created.strftime('%Y/%m/%d %H:%M:%S') if done else '',
+            str(10_000 + user),
+            f'user{user}',
+            due
+        ])
+    return rows
+
+
+def reset_sheet(rows, latency):
+    """フェイクのシートとタスク表を作り直す"""
+    worksheet = FakeWorksheet(rows, latency=latency, jitter=0, error_rate=0, read_quota=0, write_quota=0)
+    workspace = main.workspaces.default
+    workspace.session.fake_worksheet = worksheet
+    workspace.session.reset()
+    workspace.storage = create_storage(workspace.sheets)
+    workspace.table = TaskTable(workspace.storage)
+    workspace.digest = DigestEngine(workspace.table)
+    return worksheet
+
+
+# コマンド名 → (ハンドラーを呼ぶ関数, 実行ごとにシートを作り直すか)
+COMMANDS = {
+    'tasks': (lambda ctx: main.list_tasks.callback(ctx), False),
+    'urgent': (lambda ctx: main.urgent_tasks.callback(ctx), False),
+    'alltasks': (lambda ctx: main.all_tasks.callback(ctx), False),
+    'today': (lambda ctx: main.today_tasks.callback(ctx), False),
+    'complete': (lambda ctx: main.complete_task.callback(ctx, task_numbers='1'), False),
+    'taskstats': (lambda ctx: main.task_stats.callback(ctx), False),
+    'clearcompleted': (lambda ctx: main.clear_completed_tasks.callback(ctx), True),
+    'daily_reminder': (lambda ctx: main.daily_reminder.coro(), False),
+}
+
+
+async def invoke(call, author):
+    """ハンドラーのprint出力は捨てて実行する"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        await call(StubContext(author))
+
+
+async def run_command(name, rows, author, iterations, latency):
+    call, destructive = COMMANDS[name]
+    worksheet = reset_sheet(rows, latency)
+
+    # 初回（シート読み込みを含む）
+    started = time.perf_counter()
+    await invoke(call, author)
+    cold = time.perf_counter() - started
+
+    # 2回目以降
+    timings = []
+    calls = Counter()
+    for _ in range(iterations):
+        if destructive:
+            worksheet = reset_sheet(rows, latency)
+            with contextlib.redirect_stdout(io.StringIO()):
+                await main.workspaces.default.table.ensure_fresh()
+        worksheet.reset_stats()
+        started = time.perf_counter()
+        await invoke(call, author)
+        timings.append(time.perf_counter() - started)
+        calls.update(worksheet.calls)
+
+    # ピークメモリ（計測のオーバーヘッドが大きいので初回を別に1回だけ測る）
+    reset_sheet(rows, latency)
+    tracemalloc.start()
+    await invoke(call, author)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'cold': cold,
+        'p50': statistics.median(timings),
+        'p99': _percentile(timings, 99),
+        'peak': peak,
+        'calls': sum(calls.values()) / iterations,
+    }
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run(args):
+    sizes = [int(size) for size in args.sizes.split(',')]
+    names = args.commands.split(',') if args.commands else list(COMMANDS)
+
+    # Discordへの送信・確認待ちはスタブに差し替える
+    main.bot.get_channel = lambda channel_id: StubChannel()
+
+    async def wait_for(*_args, **_kwargs):
+        return StubMessage()
+    main.bot.wait_for = wait_for
+
+    print(f"{'command':<16}{'rows':>10}{'cold ms':>11}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}{'calls':>8}")
+    for size in sizes:
+        rows = generate_rows(size, args.users, seed=args.seed)
+        # 最もタスクの多いユーザーとして実行する
+        top_user = Counter(row[4] for row in rows[1:] if row[2] != 'TRUE').most_common(1)[0][0]
+        author = StubAuthor(int(top_user), 'bench')
+        for name in names:
+            result = await run_command(name, rows, author, args.iterations, args.latency)
+            print(
+                f"{name:<16}{size:>10}{result['cold'] * 1000:>11.1f}{result['p50'] * 1000:>10.2f}"
+                f"{result['p99'] * 1000:>10.2f}{result['peak'] / 1024 / 1024:>10.1f}{result['calls']:>8.1f}"
+            )
+        sys.stdout.flush()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='タスクBotのコマンドベンチマーク')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='シートの行数（カンマ区切り）')
+    parser.add_argument('--users', type=int, default=200, help='ユーザー数')
+    parser.add_argument('--iterations', type=int, default=20, help='コマンドごとの試行回数')
+    parser.add_argument('--latency', type=float, default=0.0, help='シート呼び出し1回あたりの遅延（秒）')
+    parser.add_argument('--commands', default='', help=f"対象コマンド（カンマ区切り、既定: {','.join(COMMANDS)}）")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main_cli()
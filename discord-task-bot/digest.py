@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import os
+from datetime import datetime
+
+import discord
+
+from discord_limits import EMBED_MAX_CHARS, EMBED_MAX_FIELDS, FIELD_NAME_MAX, FIELD_VALUE_MAX, truncate
+from due_dates import format_due_date
+from metrics import cache_requests
+
+# ユーザーごとに表示するタスク数
+DIGEST_TOP_TASKS = 5
+# 1回の通知で送る埋め込みの上限（ユーザーが非常に多い時も送信が終わるように）
+DIGEST_MAX_EMBEDS = int(os.environ.get('DIGEST_MAX_EMBEDS', '10'))
+# 何ユーザー分作るごとにイベントループに処理を返すか
+DIGEST_YIELD_EVERY = 200
+
+SKIPPED_FIELD = ("…", "他{}人分は省略しました（`!alltasks` で確認できます）")
+COMMANDS_FIELD = (
+    "📱 便利なコマンド",
+    "`!tasks` - 自分のタスク確認\n`!urgent` - 緊急タスクのみ\n`!today` - 今日期限のタスク\n`!complete [番号]` - タスク完了"
+)
+
+
+class DigestEngine:
+    """毎朝通知（と!testreminder）のユーザー別の要約を作る
+
+    未完了タスクを1回だけ走査して、ユーザーごとの件数・期限切れ/緊急の数・
+    緊急度順の上位5件をまとめて求める。結果は (日付, タスク表のversion) ごとに
+    キャッシュするので、朝の通知の直後のテストなどは作り直さない。
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self._key = None
+        self._fields = None
+
+    async def fields(self, today=None):
+        """ユーザーごとの埋め込みフィールド (name, value) を順に返す
+
+        未完了タスクがなければ何も返さない。
+        """
+        if today is None:
+            today = datetime.now().date()
+        # キャッシュが使える時は未完了タスクの一覧を作らない
+        await self.table.ensure_fresh()
+        if (today, self.table.version) == self._key:
+            cache_requests.labels('digest', 'hit').inc()
+            for field in self._fields:
+                yield field
+            return
+
+        cache_requests.labels('digest', 'miss').inc()
+        pending = await self.table.pending()
+        key = (today, self.table.version)
+        fields = []
+        for i, (user_name, summary) in enumerate(_summarize(pending, today).items()):
+            field = _render_field(user_name, summary, today)
+            fields.append(field)
+            yield field
+            if i % DIGEST_YIELD_EVERY == DIGEST_YIELD_EVERY - 1:
+                await asyncio.sleep(0)
+        # 最後まで作れた時だけキャッシュする
+        self._key = key
+        self._fields = fields
+
+
+async def stream_embeds(fields, title, description, footer, color=0xff9500, max_embeds=DIGEST_MAX_EMBEDS):
+    """フィールドを埋め込みに詰めて、いっぱいになった順に返す
+
+    1つの埋め込みはフィールド25個・合計6000文字まで。max_embeds個目で
+    入りきらない分は件数だけ表示する。最後の埋め込みにはコマンド案内とフッターを付ける。
+    """
+    # コマンド案内・省略の案内・フッターの分を空けておく
+    reserved = sum(map(len, COMMANDS_FIELD + SKIPPED_FIELD)) + len(footer) + 10  # 10は省略人数の桁の分
+    embed = discord.Embed(title=title, description=description, color=color)
+    size = len(title) + len(description) + reserved
+    count = 1
+    skipped = 0
+
+    async for name, value in fields:
+        if skipped:
+            skipped += 1
+            continue
+        field_size = len(name) + len(value)
+        if len(embed.fields) >= EMBED_MAX_FIELDS - 2 or size + field_size > EMBED_MAX_CHARS:
+            if count >= max_embeds:
+                skipped = 1
+                continue
+            yield embed
+            continued_title = f"{title}（続き）"
+            embed = discord.Embed(title=continued_title, color=color)
+            size = len(continued_title) + reserved
+            count += 1
+        embed.add_field(name=name, value=value, inline=False)
+        size += field_size
+
+    if skipped:
+        embed.add_field(name=SKIPPED_FIELD[0], value=SKIPPED_FIELD[1].format(skipped), inline=False)
+    embed.add_field(name=COMMANDS_FIELD[0], value=COMMANDS_FIELD[1], inline=False)
+    embed.set_footer(text=footer)
+    yield embed
+
+
+def _summarize(pending, today):
+    """未完了タスク（シート上の順）をユーザーごとにまとめる
+
+    戻り値: ユーザー名 → [件数, 期限切れ数, 緊急数, 上位タスクのヒープ]
+    ヒープには緊急度の逆順で (−緊急度, −行番号, タスク) を最大5件だけ残す。
+    """
+    today_ordinal = today.toordinal()
+    summaries = {}
+    for task in pending:
+        summary = summaries.get(task.user_name)
+        if summary is None:
+            summary = summaries[task.user_name] = [0, 0, 0, []]
+        summary[0] += 1
+
+        if task.due_date:
+            diff = task.due_date.toordinal() - today_ordinal
+            if diff < 0:
+                summary[1] += 1
+                level = -1  # 期限切れは最優先
+            else:
+                if diff <= 3:
+                    summary[2] += 1
+                level = diff
+        else:
+            level = 999  # 期限なしは最後
+
+        top = summary[3]
+        entry = (-level, -task.row, task)
+        if len(top) < DIGEST_TOP_TASKS:
+            heapq.heappush(top, entry)
+        elif entry > top[0]:
+            heapq.heapreplace(top, entry)
+    return summaries
+
+
+def _render_field(user_name, summary, today):
+    task_count, overdue_count, urgent_count, top = summary
+
+    # タスクリストを作成（最大5件、緊急タスクを優先表示）
+    task_list = ""
+    for _level, _row, task in sorted(top, reverse=True):
+        task_list += f"• {task.name} - {format_due_date(task.due_date, today)}\n"
+
+    # 5件を超える場合は「他○件」を追加
+    if task_count > DIGEST_TOP_TASKS:
+        task_list += f"• ... 他{task_count - DIGEST_TOP_TASKS}件\n"
+
+    # フィールドタイトルに緊急情報を追加
+    field_title = f"📝 {user_name}さん ({task_count}件"
+    if overdue_count > 0:
+        field_title += f", 🔴{overdue_count}件期限切れ"
+    elif urgent_count > 0:
+        field_title += f", 🟡{urgent_count}件緊急"
+    field_title += ")"
+
+    return truncate(field_title, FIELD_NAME_MAX), truncate(task_list or "タスクなし", FIELD_VALUE_MAX)
@@ -0,0 +1,12 @@
+# Discordのメッセージ・埋め込みの文字数などの制限
+MESSAGE_MAX_CHARS = 2000
+EMBED_DESCRIPTION_MAX = 4096
+EMBED_MAX_FIELDS = 25
+EMBED_MAX_CHARS = 6000
+FIELD_NAME_MAX = 256
+FIELD_VALUE_MAX = 1024
+
+
+def truncate(text, limit):
+    """limit文字を超える分を「…」にして切り詰める"""
+    return text if len(text) <= limit else text[:limit - 1] + "…"
@@ -0,0 +1,178 @@
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+# 今日・明日などの言い方 → 今日からの日数
+RELATIVE_DAYS = {
+    '今日': 0, 'きょう': 0, 'today': 0,
+    '明日': 1, 'あした': 1, 'あす': 1, 'tomorrow': 1,
+    '明後日': 2, 'あさって': 2,
+}
+
+# 曜日指定（先に見つかったものを使うので順番に意味がある）
+WEEKDAYS = (
+    ('月', 0), ('火', 1), ('水', 2), ('木', 3), ('金', 4), ('土', 5), ('日', 6),
+    ('月曜', 0), ('火曜', 1), ('水曜', 2), ('木曜', 3), ('金曜', 4), ('土曜', 5), ('日曜', 6),
+    ('monday', 0), ('tuesday', 1), ('wednesday', 2), ('thursday', 3), ('friday', 4), ('saturday', 5), ('sunday', 6),
+)
+
+DAYS_LATER_PATTERN = re.compile(r'(\d+)日後')
+
+# 日付形式（YYYY-MM-DD, YYYY/MM/DD, MM/DD, MM-DD）
+DATE_PATTERNS = (
+    re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})'),
+    re.compile(r'(\d{4})/(\d{1,2})/(\d{1,2})'),
+    re.compile(r'(\d{1,2})/(\d{1,2})'),
+    re.compile(r'(\d{1,2})-(\d{1,2})'),
+)
+
+# parse_due_dateの結果のメモ（今日の日付が変わったら捨てる）
+DUE_MEMO_SIZE = 1024
+_memo = {}
+_memo_day = None
+
+
+def parse_due_date(due_text, today=None):
+    """自然言語の期限を日付に変換
+
+    結果は (入力, 今日の日付) ごとにメモしておき、日付が変わったら破棄する。
+    """
+    global _memo_day
+    if not due_text:
+        return None
+    if today is None:
+        today = datetime.now().date()
+    if today != _memo_day or len(_memo) >= DUE_MEMO_SIZE:
+        _memo.clear()
+        _memo_day = today
+    try:
+        return _memo[due_text]
+    except KeyError:
+        result = _memo[due_text] = _parse_due_date(due_text, today)
+        return result
+
+
+def split_task_input(task_input, today=None):
+    """「タスク名 期限」を (タスク名, 期限の日付) に分ける
+
+    最後の空白以降が期限として認識できなければ、全体をタスク名として扱う。
+    """
+    parts = task_input.rsplit(' ', 1)
+    if len(parts) == 2:
+        task_name, due_text = parts
+        due_date = parse_due_date(due_text, today)
+        if due_date is not None:
+            return task_name, due_date
+    return task_input, None
+
+
+def _parse_due_date(due_text, today):
+    due_text = due_text.strip().lower()
+
+    # 今日・明日
+    days = RELATIVE_DAYS.get(due_text)
+    if days is not None:
+        return today + timedelta(days=days)
+
+    # 曜日指定
+    for day_name, weekday in WEEKDAYS:
+        if day_name in due_text:
+            days_ahead = weekday - today.weekday()
+            if days_ahead <= 0:  # 今週の該当曜日が過ぎている場合は来週
+                days_ahead += 7
+            return today + timedelta(days=days_ahead)
+
+    # 相対的な日数
+    if '日後' in due_text:
+        match = DAYS_LATER_PATTERN.search(due_text)
+        if match:
+            return today + timedelta(days=int(match.group(1)))
+
+    # 週指定
+    if '来週' in due_text or 'next week' in due_text:
+        return today + timedelta(days=7)
+    elif '再来週' in due_text:
+        return today + timedelta(days=14)
+
+    # 月指定
+    if '来月' in due_text or 'next month' in due_text:
+        return today + timedelta(days=30)
+
+    for pattern in DATE_PATTERNS:
+        match = pattern.search(due_text)
+        if match:
+            try:
+                if len(match.groups()) == 3:  # 年月日
+                    year, month, day = match.groups()
+                    return date(int(year), int(month), int(day))
+                else:  # 月日のみ（今年として扱う）
+                    month, day = match.groups()
+                    due_date = date(today.year, int(month), int(day))
+                    # 過去の日付の場合は来年として扱う
+                    if due_date < today:
+                        due_date = date(today.year + 1, int(month), int(day))
+                    return due_date
+            except ValueError:
+                continue
+
+    return None
+
+
+@lru_cache(maxsize=4096)
+def parse_stored_date(text):
+    """シートに保存された期限（YYYY-MM-DD）を日付に変換
+
+    期限の種類は行数よりずっと少ないので、結果をキャッシュして
+    読み直しのたびに同じ文字列を変換しないようにしている。
+    """
+    if not text:
+        return None
+    # botが書き込む形式（ゼロ埋めのYYYY-MM-DD）はstrptimeを使わずに変換
+    if (len(text) == 10 and text[4] == '-' and text[7] == '-'
+            and text[:4].isdigit() and text[5:7].isdigit() and text[8:].isdigit()):
+        try:
+            return date(int(text[:4]), int(text[5:7]), int(text[8:]))
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def format_due_date(due_date, today=None):
+    """期限を見やすい形式でフォーマット"""
+    if not due_date:
+        return "期限なし"
+
+    if today is None:
+        today = datetime.now().date()
+    diff = (due_date - today).days
+
+    if diff < 0:
+        return f"🔴 期限切れ ({due_date.strftime('%m/%d')})"
+    elif diff == 0:
+        return f"🔴 今日まで ({due_date.strftime('%m/%d')})"
+    elif diff == 1:
+        return f"🟠 明日まで ({due_date.strftime('%m/%d')})"
+    elif diff <= 3:
+        return f"🟡 {diff}日後 ({due_date.strftime('%m/%d')})"
+    elif diff <= 7:
+        return f"🟢 {diff}日後 ({due_date.strftime('%m/%d')})"
+    else:
+        return f"⚪ {due_date.strftime('%m/%d')}"
+
+
+def get_urgency_level(due_date, today=None):
+    """緊急度レベルを取得（ソート用）"""
+    if not due_date:
+        return 999  # 期限なしは最後
+
+    if today is None:
+        today = datetime.now().date()
+    diff = (due_date - today).days
+
+    if diff < 0:
+        return -1  # 期限切れは最優先
+    else:
+        return diff
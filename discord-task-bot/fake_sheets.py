@@ -0,0 +1,191 @@
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+
+from gspread.exceptions import APIError
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+from sheets_session import HEADER, SheetsSession
+
+# SHEETS_FAKE=true の時に使う設定
+FAKE_SHEETS_LATENCY = float(os.environ.get('FAKE_SHEETS_LATENCY', '0.2'))
+FAKE_SHEETS_JITTER = float(os.environ.get('FAKE_SHEETS_JITTER', '0.1'))
+FAKE_SHEETS_ERROR_RATE = float(os.environ.get('FAKE_SHEETS_ERROR_RATE', '0'))
+# 1分あたりのリクエスト上限（0なら無制限）。Google Sheets APIの既定はユーザーごとに60
+FAKE_SHEETS_READ_QUOTA = int(os.environ.get('FAKE_SHEETS_READ_QUOTA', '60'))
+FAKE_SHEETS_WRITE_QUOTA = int(os.environ.get('FAKE_SHEETS_WRITE_QUOTA', '60'))
+
+READ_METHODS = ('get_all_values', 'row_values', 'batch_get')
+
+
+class _FakeResponse:
+    """APIErrorに渡すためのrequests.Response相当"""
+
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.text = message
+        self._message = message
+
+    def json(self):
+        return {'error': {'code': self.status_code, 'message': self._message}}
+
+
+class FakeWorksheet:
+    """ネットワークを使わないメモリ上のワークシート
+
+    botが使うgspreadのメソッドだけを実装している。呼び出しごとに
+    遅延・ランダムなエラー・1分あたりの読み書き上限を再現できるので、
+    負荷試験やレイテンシの調整をオフラインで行える。
+    calls には呼び出し回数がメソッド名ごとに記録される。
+    """
+
+    def __init__(self, rows=None, title='tasks', latency=FAKE_SHEETS_LATENCY, jitter=FAKE_SHEETS_JITTER,
+                 error_rate=FAKE_SHEETS_ERROR_RATE, read_quota=FAKE_SHEETS_READ_QUOTA,
+                 write_quota=FAKE_SHEETS_WRITE_QUOTA, seed=None):
+        self.title = title
+        self.rows = [list(row) for row in rows] if rows is not None else [list(HEADER)]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quotas = {'read': read_quota, 'write': write_quota}
+        self.calls = Counter()
+        self._recent = {'read': deque(), 'write': deque()}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _request(self, method):
+        """1リクエスト分の遅延・上限・エラーを再現する"""
+        kind = 'read' if method in READ_METHODS else 'write'
+        with self._lock:
+            self.calls[method] += 1
+            now = time.monotonic()
+            recent = self._recent[kind]
+            while recent and now - recent[0] >= 60:
+                recent.popleft()
+            quota = self.quotas[kind]
+            if quota and len(recent) >= quota:
+                raise APIError(_FakeResponse(429, f"Quota exceeded for {kind} requests per minute"))
+            recent.append(now)
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.latency else 0
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise APIError(_FakeResponse(503, "The service is currently unavailable."))
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+            self._recent = {'read': deque(), 'write': deque()}
+
+    def _last_row(self):
+        last = len(self.rows)
+        while last and not any(self.rows[last - 1]):
+            last -= 1
+        return last
+
+    def _read_range(self, range_name):
+        grid = a1_range_to_grid_range(range_name)
+        start_row = grid.get('startRowIndex', 0)
+        end_row = min(grid.get('endRowIndex', len(self.rows)), len(self.rows))
+        start_col = grid.get('startColumnIndex', 0)
+        end_col = grid.get('endColumnIndex')
+        values = []
+        for row in self.rows[start_row:end_row]:
+            cells = row[start_col:end_col]
+            while cells and cells[-1] == '':
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def _write_range(self, range_name, values):
+        grid = a1_range_to_grid_range(range_name)
+        start_row = grid.get('startRowIndex', 0)
+        start_col = grid.get('startColumnIndex', 0)
+        for i, row_values in enumerate(values):
+            while len(self.rows) <= start_row + i:
+                self.rows.append([])
+            row = self.rows[start_row + i]
+            if len(row) < start_col + len(row_values):
+                row.extend([''] * (start_col + len(row_values) - len(row)))
+            for j, value in enumerate(row_values):
+                row[start_col + j] = str(value)
+
+    def get_all_values(self):
+        self._request('get_all_values')
+        rows = self.rows[:self._last_row()]
+        width = max((len(row) for row in rows), default=0)
+        return [row + [''] * (width - len(row)) for row in rows]
+
+    def row_values(self, row):
+        self._request('row_values')
+        values = list(self.rows[row - 1]) if row <= len(self.rows) else []
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        self._request('batch_get')
+        return [self._read_range(range_name) for range_name in ranges]
+
+    def append_row(self, values, **kwargs):
+        self._request('append_row')
+        return self._append([values])
+
+    def append_rows(self, values, **kwargs):
+        self._request('append_rows')
+        return self._append(values)
+
+    def _append(self, rows):
+        del self.rows[self._last_row():]
+        first = len(self.rows) + 1
+        self.rows.extend([str(value) for value in row] for row in rows)
+        # gspreadと同じく書き込んだ範囲を返す
+        return {'updates': {'updatedRange': f"'{self.title}'!A{first}:G{len(self.rows)}"}}
+
+    def update_cell(self, row, col, value):
+        self._request('update_cell')
+        self._write_range(rowcol_to_a1(row, col), [[value]])
+
+    def update(self, range_name, values=None, **kwargs):
+        self._request('update')
+        self._write_range(range_name, values)
+
+    def batch_update(self, data, **kwargs):
+        self._request('batch_update')
+        for item in data:
+            self._write_range(item['range'], item['values'])
+
+    def clear(self):
+        self._request('clear')
+        self.rows = []
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet, title='discord-task (fake)'):
+        self.title = title
+        self._worksheet = worksheet
+
+    def worksheet(self, title):
+        return self._worksheet
+
+    def worksheets(self):
+        return [self._worksheet]
+
+
+class FakeSheetsSession(SheetsSession):
+    """FakeWorksheetにつなぐSheetsSession（認証・通信なし）"""
+
+    def __init__(self, spreadsheet_id=None, sheet_name='tasks', worksheet=None):
+        super().__init__(spreadsheet_id, sheet_name)
+        self.fake_worksheet = worksheet or FakeWorksheet(title=sheet_name)
+
+    def _connect(self):
+        self.spreadsheet = FakeSpreadsheet(self.fake_worksheet)
+        self.worksheet = self.fake_worksheet
+        print(f"🧪 フェイクのワークシートに接続しました: {self.sheet_name}")
+
@@ -0,0 +1,73 @@
+import os
+from datetime import datetime
+
+from aiohttp import web
+
+import metrics
+from loop_monitor import heartbeat_age
+
+HEALTH_SERVER_HOST = os.environ.get('HEALTH_SERVER_HOST', '0.0.0.0')
+HEALTH_SERVER_PORT = int(os.environ.get('HEALTH_SERVER_PORT', '8080'))
+
+
+def health_status(bot, lag_monitor):
+    """/health の内容"""
+    age = heartbeat_age(bot)
+    return {
+        "status": "healthy",
+        "bot_ready": bot.is_ready(),
+        "timestamp": datetime.now().isoformat(),
+        "loop_lag_seconds": round(lag_monitor.lag, 4),
+        "max_loop_lag_seconds": round(lag_monitor.max_lag, 4),
+        "heartbeat_age_seconds": round(age, 3) if age is not None else None,
+    }
+
+
+class HealthServer:
+    """botと同じイベントループで動くUptimeRobot用のWebサーバー
+
+    Flask版と同じ / /health /ping に加えて /metrics を返す。
+    別スレッドを立てないので、/health からbotの状態を安全に読める。
+    """
+
+    def __init__(self, bot, lag_monitor, host=HEALTH_SERVER_HOST, port=HEALTH_SERVER_PORT):
+        self.bot = bot
+        self.lag_monitor = lag_monitor
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        """サーバーを起動（起動済みなら何もしない）"""
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.add_routes([
+            web.get('/', self.home),
+            web.get('/health', self.health),
+            web.get('/ping', self.ping),
+            web.get('/metrics', self.metrics),
+        ])
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        self._runner = runner
+        print(f"🌐 Webサーバー起動完了 (ポート: {self.port})")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def home(self, request):
+        return web.Response(text="Discord Task Bot is running! 🤖")
+
+    async def health(self, request):
+        return web.json_response(health_status(self.bot, self.lag_monitor))
+
+    async def ping(self, request):
+        return web.Response(text="pong")
+
+    async def metrics(self, request):
+        return web.Response(body=metrics.registry.render().encode('utf-8'),
+                            headers={'Content-Type': metrics.CONTENT_TYPE})
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+from datetime import datetime
+
+import metrics
+
+# イベントループの遅れを測る間隔（秒）
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', '0.5'))
+# この秒数以上ループが止まったら記録する（0なら監視しない）
+LOOP_STALL_THRESHOLD = float(os.environ.get('LOOP_STALL_THRESHOLD', '1.0'))
+# 記録しておく停止の件数
+LOOP_STALL_HISTORY = 20
+# 記録するスタックの深さ
+STALL_STACK_LIMIT = 12
+
+# ループが止まった時の記録
+#   started_at: 検出した時刻 / duration: 止まっていた秒数（ループが再開するまで None）
+#   command: 実行中だったコマンド / sheets_calls: 実行中だったシート呼び出し
+#   stack: 止まっていた時のループのスレッドのスタック（新しい呼び出しが最後）
+Stall = namedtuple('Stall', ['started_at', 'duration', 'command', 'sheets_calls', 'stack'])
+
+
+class LoopLagMonitor:
+    """イベントループの遅れを測り、止まった時の様子を記録する
+
+    ループ上のタスクが一定間隔で眠り、予定した時刻からどれだけ遅れて起きたかを
+    記録する。同期処理がループを止めていると、その分だけ遅れが大きくなる。
+    止まっている間はループ上では何もできないので、別スレッドの見張りが
+    最後に起きた時刻を調べ、しきい値を超えたらその時点で実行中のコマンド・
+    シート呼び出し・ループのスレッドのスタックを記録する。
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, stall_threshold=LOOP_STALL_THRESHOLD, in_flight=None):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        # 実行中のシート呼び出しを返す関数（{label: 件数}）
+        self.in_flight = in_flight
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.last_tick = None
+        self.stalls = deque(maxlen=LOOP_STALL_HISTORY)
+        self._task = None
+        self._loop = None
+        self._loop_thread_id = None
+        self._watchdog = None
+        self._current_stall = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """計測を開始（起動済みなら何もしない）"""
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread_id = threading.get_ident()
+            self.last_tick = time.monotonic()
+            self._task = self._loop.create_task(self._run())
+        if self.stall_threshold and self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self._watchdog.start()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - expected)
+            self.max_lag = max(self.max_lag, self.lag)
+            self.last_tick = time.monotonic()
+            metrics.loop_lag.set(self.lag)
+            with self._lock:
+                stall, self._current_stall = self._current_stall, None
+            if stall is not None:
+                self._finish_stall(stall._replace(duration=self.lag))
+
+    def _watch(self):
+        """別スレッドでループが止まっていないか見張る"""
+        while True:
+            time.sleep(self.interval)
+            # 起きるべき時刻からの遅れ
+            blocked = time.monotonic() - self.last_tick - self.interval
+            if blocked < self.stall_threshold:
+                continue
+            with self._lock:
+                if self._current_stall is None:
+                    self._current_stall = self._capture()
+
+    def _capture(self):
+        """ループのスレッドで今何が動いているかを記録する"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.format_list(traceback.extract_stack(frame)[-STALL_STACK_LIMIT:]) if frame else []
+        task = asyncio.current_task(self._loop)
+        command = metrics.running_commands.get(task) if task else None
+        if command is None and task is not None:
+            command = task.get_name()
+        try:
+            sheets_calls = dict(self.in_flight()) if self.in_flight else {}
+        except RuntimeError:
+            sheets_calls = {}
+        return Stall(datetime.now(), None, command, sheets_calls, stack)
+
+    def _finish_stall(self, stall):
+        self.stalls.append(stall)
+        metrics.loop_stalls.inc()
+        calls = ', '.join(f"{label}×{count}" for label, count in stall.sheets_calls.items()) or 'なし'
+        print(f"⚠️ イベントループが{stall.duration:.2f}秒止まりました"
+              f"（コマンド: {stall.command or '不明'}, 実行中のシート呼び出し: {calls}）\n"
+              + ''.join(stall.stack))
+
+
+def heartbeat_age(bot):
+    """Discordのゲートウェイから最後にハートビートの応答を受けてからの秒数（未接続ならNone）"""
+    keep_alive = getattr(getattr(bot, 'ws', None), '_keep_alive', None)
+    last_ack = getattr(keep_alive, '_last_ack', None)
+    if last_ack is None:
+        return None
+    # discord.pyはperf_counterで記録している
+    return time.perf_counter() - last_ack
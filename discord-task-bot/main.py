@@ -5,6 +5,7 @@ load_dotenv()
 
 # 他のimport文
 import discord
+from discord import app_commands
 from discord.ext import commands, tasks
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
@@ -12,9 +13,17 @@ import os
 import json
 import asyncio
 from datetime import datetime, time, timedelta
-from flask import Flask
 import threading
-import re
+
+import metrics
+from digest import stream_embeds
+from due_dates import format_due_date, split_task_input
+from health_server import HealthServer, health_status
+from loop_monitor import LoopLagMonitor, heartbeat_age
+from sheets_scheduler import set_background
+from sheets_session import SheetsSession
+from task_pages import AllTasksView, TaskListView
+from workspaces import GUILD_SHEETS, SheetTarget, WorkspacePool, parse_routes
 
 # .envファイルを読み込む（Secretsが使えない場合）
 try:
@@ -23,26 +32,33 @@ try:
 except ImportError:
     pass  # dotenvがない場合はスキップ
 
-# FlaskアプリでUptimeRobot用のWebサーバー
-app = Flask(__name__)
+# UptimeRobot用のWebサーバー（flask: 別スレッドのFlask / async: botのイベントループ上 / off: なし）
+HEALTH_SERVER = os.environ.get('HEALTH_SERVER', 'flask')
+# 起動時にスラッシュコマンドをDiscordに登録するか
+SYNC_SLASH_COMMANDS = os.environ.get('SYNC_SLASH_COMMANDS', 'true').lower() in ('1', 'true', 'yes')
+
+def run_flask():
+    # Flaskは使う時だけimportする（async/offの時はメモリと起動時間を節約）
+    from flask import Flask
 
-@app.route('/')
-def home():
-    return "Discord Task Bot is running! 🤖"
+    app = Flask(__name__)
 
-@app.route('/health')
-def health():
-    return {
-        "status": "healthy", 
-        "bot_ready": bot.is_ready() if 'bot' in globals() else False,
-        "timestamp": datetime.now().isoformat()
-    }
+    @app.route('/')
+    def home():
+        return "Discord Task Bot is running! 🤖"
 
-@app.route('/ping')
-def ping():
-    return "pong"
+    @app.route('/health')
+    def health():
+        return health_status(bot, loop_monitor)
+
+    @app.route('/ping')
+    def ping():
+        return "pong"
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return metrics.registry.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
 
-def run_flask():
     try:
         print("🌐 Flaskサーバーを起動中...")
         app.run(host='0.0.0.0', port=8080, debug=False, use_reloader=False, threaded=True)
@@ -53,213 +69,67 @@ def run_flask():
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
-
-SPREADSHEET_ID = os.environ.get('SPREADSHEET_ID')
-SHEET_NAME = 'tasks'
-
-def parse_due_date(due_text):
-    """自然言語の期限を日付に変換"""
-    if not due_text:
-        return None
-    
-    due_text = due_text.strip().lower()
-    today = datetime.now().date()
-    
-    # 今日・明日
-    if due_text in ['今日', 'きょう', 'today']:
-        return today
-    elif due_text in ['明日', 'あした', 'あす', 'tomorrow']:
-        return today + timedelta(days=1)
-    elif due_text in ['明後日', 'あさって']:
-        return today + timedelta(days=2)
-    
-    # 曜日指定
-    weekdays = {
-        '月': 0, '火': 1, '水': 2, '木': 3, '金': 4, '土': 5, '日': 6,
-        '月曜': 0, '火曜': 1, '水曜': 2, '木曜': 3, '金曜': 4, '土曜': 5, '日曜': 6,
-        'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6
-    }
-    
-    for day_name, weekday in weekdays.items():
-        if day_name in due_text:
-            days_ahead = weekday - today.weekday()
-            if days_ahead <= 0:  # 今週の該当曜日が過ぎている場合は来週
-                days_ahead += 7
-            return today + timedelta(days=days_ahead)
-    
-    # 相対的な日数
-    if '日後' in due_text or '日後' in due_text:
-        match = re.search(r'(\d+)日後', due_text)
-        if match:
-            days = int(match.group(1))
-            return today + timedelta(days=days)
-    
-    # 週指定
-    if '来週' in due_text or 'next week' in due_text:
-        return today + timedelta(days=7)
-    elif '再来週' in due_text:
-        return today + timedelta(days=14)
-    
-    # 月指定
-    if '来月' in due_text or 'next month' in due_text:
-        return today + timedelta(days=30)
-    
-    # 日付形式（YYYY-MM-DD, MM/DD, MM-DD）
-    date_patterns = [
-        r'(\d{4})-(\d{1,2})-(\d{1,2})',
-        r'(\d{4})/(\d{1,2})/(\d{1,2})',
-        r'(\d{1,2})/(\d{1,2})',
-        r'(\d{1,2})-(\d{1,2})'
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, due_text)
-        if match:
-            try:
-                if len(match.groups()) == 3:  # 年月日
-                    year, month, day = match.groups()
-                    return datetime(int(year), int(month), int(day)).date()
-                else:  # 月日のみ（今年として扱う）
-                    month, day = match.groups()
-                    year = today.year
-                    date = datetime(year, int(month), int(day)).date()
-                    # 過去の日付の場合は来年として扱う
-                    if date < today:
-                        date = datetime(year + 1, int(month), int(day)).date()
-                    return date
-            except ValueError:
-                continue
-    
-    return None
-
-def format_due_date(due_date):
-    """期限を見やすい形式でフォーマット"""
-    if not due_date:
-        return "期限なし"
-    
-    today = datetime.now().date()
-    diff = (due_date - today).days
-    
-    if diff < 0:
-        return f"🔴 期限切れ ({due_date.strftime('%m/%d')})"
-    elif diff == 0:
-        return f"🔴 今日まで ({due_date.strftime('%m/%d')})"
-    elif diff == 1:
-        return f"🟠 明日まで ({due_date.strftime('%m/%d')})"
-    elif diff <= 3:
-        return f"🟡 {diff}日後 ({due_date.strftime('%m/%d')})"
-    elif diff <= 7:
-        return f"🟢 {diff}日後 ({due_date.strftime('%m/%d')})"
-    else:
-        return f"⚪ {due_date.strftime('%m/%d')}"
-
-def get_urgency_level(due_date):
-    """緊急度レベルを取得（ソート用）"""
-    if not due_date:
-        return 999  # 期限なしは最後
-    
-    today = datetime.now().date()
-    diff = (due_date - today).days
-    
-    if diff < 0:
-        return -1  # 期限切れは最優先
-    else:
-        return diff
-
-def setup_google_sheets():
-    try:
-        # 環境変数チェック
-        credentials_json = os.environ.get('GOOGLE_SERVICE_KEY')
-        if not credentials_json:
-            print("❌ GOOGLE_SERVICE_KEY環境変数が見つかりません")
-            return None
-
-        if not SPREADSHEET_ID:
-            print("❌ SPREADSHEET_ID環境変数が見つかりません")
-            return None
-
-        # JSON解析
+# コマンドの処理時間・Discordへの送信時間を /metrics に記録する
+metrics.instrument_bot(bot)
+metrics.instrument_send(discord.abc.Messageable, commands.Context)
+# イベントループの遅れの計測と、ループ上で動くWebサーバー
+loop_monitor = LoopLagMonitor(in_flight=lambda: workspaces.in_flight())
+health_server = HealthServer(bot, loop_monitor)
+
+async def setup_hook():
+    # ログイン前にbotのイベントループ上で呼ばれる
+    loop_monitor.start()
+    if HEALTH_SERVER == 'async':
+        await health_server.start()
+    if SYNC_SLASH_COMMANDS:
         try:
-            credentials_dict = json.loads(credentials_json)
-        except json.JSONDecodeError as e:
-            print(f"❌ Google認証JSON解析エラー: {e}")
-            return None
+            synced = await bot.tree.sync()
+            print(f"✅ スラッシュコマンドを{len(synced)}件登録しました")
+        except discord.HTTPException as e:
+            print(f"❌ スラッシュコマンドの登録エラー: {e}")
 
-        # スコープ設定
-        scope = [
-            'https://spreadsheets.google.com/feeds',
-            'https://www.googleapis.com/auth/drive'
-        ]
+bot.setup_hook = setup_hook
 
-        # 認証情報作成
-        try:
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict, scope)
-            client = gspread.authorize(creds)
-        except Exception as e:
-            print(f"❌ Google認証エラー: {e}")
-            return None
-
-        # スプレッドシート接続
-        try:
-            spreadsheet = client.open_by_key(SPREADSHEET_ID)
-            print(f"✅ スプレッドシート接続成功: {spreadsheet.title}")
-        except Exception as e:
-            print(f"❌ スプレッドシート接続エラー: {e}")
-            print(f"   SPREADSHEET_ID: {SPREADSHEET_ID}")
-            return None
-
-        # ワークシート取得
-        try:
-            sheet = spreadsheet.worksheet(SHEET_NAME)
-            print(f"✅ ワークシート接続成功: {SHEET_NAME}")
-            return sheet
-        except gspread.WorksheetNotFound:
-            print(f"❌ ワークシート '{SHEET_NAME}' が見つかりません")
-            print(f"   利用可能なシート: {[ws.title for ws in spreadsheet.worksheets()]}")
-            # tasksシートがない場合は作成
-            try:
-                sheet = spreadsheet.add_worksheet(title=SHEET_NAME, rows=1000, cols=10)
-                # 新しいヘッダー（期限フィールド追加）
-                sheet.append_row(['タスク名', '作成日', '完了', '完了日', 'ユーザーID', 'ユーザー名', '期限'])
-                print(f"✅ ワークシート '{SHEET_NAME}' を作成しました")
-                return sheet
-            except Exception as create_error:
-                print(f"❌ ワークシート作成エラー: {create_error}")
-                return None
-        except Exception as e:
-            print(f"❌ ワークシート取得エラー: {e}")
-            return None
+SPREADSHEET_ID = os.environ.get('SPREADSHEET_ID')
+SHEET_NAME = 'tasks'
 
-    except Exception as e:
-        print(f"❌ Google Sheets設定エラー: {e}")
-        return None
+# ギルド・チャンネルごとのスプレッドシート（SHEETS_FAKE=trueならネットワークなしのフェイク）
+if os.environ.get('SHEETS_FAKE', '').lower() in ('1', 'true', 'yes'):
+    from fake_sheets import FakeSheetsSession as session_factory
+else:
+    session_factory = SheetsSession
+# 接続・保存先（TASK_STORAGE=sheets / sqlite）・メモリ上のタスク表・毎朝通知の要約を
+# スプレッドシートごとにまとめて使い回す（GUILD_SHEETSにないギルドは既定のシート）
+workspaces = WorkspacePool(SheetTarget(SPREADSHEET_ID, SHEET_NAME), routes=parse_routes(GUILD_SHEETS, SHEET_NAME),
+                           session_factory=session_factory)
 
 @bot.event
 async def on_ready():
     print(f'🤖 {bot.user} がオンラインになりました！')
 
-    # シート初期化チェック
-    sheet = setup_google_sheets()
-    if sheet:
-        try:
-            headers = sheet.row_values(1)
-            if not headers or headers[0] != 'タスク名':
-                sheet.clear()
-                # 新しいヘッダー（期限フィールド追加）
-                sheet.append_row(['タスク名', '作成日', '完了', '完了日', 'ユーザーID', 'ユーザー名', '期限'])
-                print("✅ スプレッドシート初期化完了")
-            elif len(headers) < 7:  # 期限フィールドがない場合は追加
-                sheet.update_cell(1, 7, '期限')
-                print("✅ 期限フィールドを追加しました")
-        except Exception as e:
-            print(f"❌ 初期化エラー: {e}")
+    # シート初期化チェックと、書き込み待ちのタスクなどのバックグラウンド処理の開始
+    # （再接続でon_readyが何度呼ばれても1回だけ）
+    await workspaces.default.ready()
 
     # 毎日通知開始
     if not daily_reminder.is_running():
         daily_reminder.start()
         print("⏰ 毎日通知を開始しました")
 
-@bot.command(name='addtask')
+def new_task_row(task_name, due_date, author, now):
+    """追加するタスクのシートの1行"""
+    return [
+        task_name,
+        now,
+        'FALSE',
+        '',
+        str(author.id),
+        author.display_name,
+        due_date.strftime('%Y-%m-%d') if due_date else ''
+    ]
+
+@bot.hybrid_command(name='addtask')
+@app_commands.describe(task_input="タスク名と期限（例: レポート提出 明日）")
 async def add_task(ctx, *, task_input):
     """タスクを追加（期限付き対応）
     使用例：
@@ -268,36 +138,16 @@ async def add_task(ctx, *, task_input):
     !addtask プレゼン準備 来週金曜
     """
     try:
-        sheet = setup_google_sheets()
-        if not sheet:
-            await ctx.send("❌ スプレッドシートに接続できません")
-            return
-
+        # スラッシュコマンドの時は応答期限（3秒）に間に合わない場合に備えて先に応答しておく
+        await ctx.defer()
+        # このギルド・チャンネルのスプレッドシートのタスク表
+        task_table = (await workspaces.for_context(ctx)).table
         # タスク名と期限を分離
-        parts = task_input.rsplit(' ', 1)
-        if len(parts) == 2:
-            task_name, due_text = parts
-            due_date = parse_due_date(due_text)
-            if due_date is None:
-                # 期限として認識できない場合はタスク名の一部として扱う
-                task_name = task_input
-                due_date = None
-        else:
-            task_name = task_input
-            due_date = None
+        task_name, due_date = split_task_input(task_input)
 
         now = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
-        due_date_str = due_date.strftime('%Y-%m-%d') if due_date else ''
-
-        sheet.append_row([
-            task_name,
-            now,
-            'FALSE',
-            '',
-            str(ctx.author.id),
-            ctx.author.display_name,
-            due_date_str
-        ])
+
+        await task_table.append(new_task_row(task_name, due_date, ctx.author, now))
 
         embed = discord.Embed(
             title="✅ タスク追加完了",
@@ -327,38 +177,69 @@ async def add_task(ctx, *, task_input):
         await ctx.send(f"❌ エラー: {str(e)}")
         print(f"❌ タスク追加エラー: {e}")
 
-@bot.command(name='tasks')
-async def list_tasks(ctx):
-    """自分のタスクを期限順で表示"""
+@bot.command(name='addtasks')
+async def add_tasks(ctx, *, task_input):
+    """複数のタスクを1行ずつまとめて追加
+    使用例：
+    !addtasks
+    レポート提出 明日
+    買い物
+    プレゼン準備 来週金曜
+    """
     try:
-        sheet = setup_google_sheets()
-        if not sheet:
-            await ctx.send("❌ スプレッドシートに接続できません")
+        task_table = (await workspaces.for_context(ctx)).table
+        now = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+        added = []
+        for line in task_input.splitlines():
+            # 箇条書きの記号は取り除く
+            line = line.strip().lstrip('-・•*').strip()
+            if line:
+                added.append(split_task_input(line))
+
+        if not added:
+            await ctx.send("❌ 追加するタスクがありません（1行に1つずつ書いてください）")
             return
 
-        all_values = sheet.get_all_values()
+        # 全行をまとめて書き込む（シートへはappend_rows 1回）
+        await task_table.append_many([
+            new_task_row(task_name, due_date, ctx.author, now) for task_name, due_date in added
+        ])
+
+        task_list = ""
+        for i, (task_name, due_date) in enumerate(added):
+            line = f"• **{task_name}** - {format_due_date(due_date)}\n"
+            if len(task_list) + len(line) > 3900:  # 埋め込みの説明は4096文字まで
+                task_list += f"• ... 他{len(added) - i}件\n"
+                break
+            task_list += line
 
-        if len(all_values) <= 1:
+        embed = discord.Embed(
+            title=f"✅ {len(added)}件のタスクを追加しました",
+            description=task_list,
+            color=0x00ff00
+        )
+        embed.set_author(name=ctx.author.display_name)
+
+        await ctx.send(embed=embed)
+        print(f"✅ タスク一括追加: {len(added)}件 by {ctx.author.display_name}")
+
+    except Exception as e:
+        await ctx.send(f"❌ エラー: {str(e)}")
+        print(f"❌ タスク一括追加エラー: {e}")
+
+@bot.hybrid_command(name='tasks')
+async def list_tasks(ctx):
+    """自分のタスクを期限順で表示"""
+    try:
+        await ctx.defer()
+        task_table = (await workspaces.for_context(ctx)).table
+        # 期限順に並んだ索引から取得
+        user_tasks = await task_table.pending_tasks(str(ctx.author.id))
+
+        if task_table.task_count == 0:
             await ctx.send("📋 現在、タスクはありません")
             return
 
-        user_tasks = []
-        for i, row in enumerate(all_values[1:], start=2):
-            if len(row) >= 6 and row[4] == str(ctx.author.id) and row[2] != 'TRUE':
-                due_date = None
-                if len(row) >= 7 and row[6]:
-                    try:
-                        due_date = datetime.strptime(row[6], '%Y-%m-%d').date()
-                    except ValueError:
-                        pass
-                
-                user_tasks.append({
-                    'row': i,
-                    'name': row[0],
-                    'created': row[1],
-                    'due_date': due_date
-                })
-
         if not user_tasks:
             embed = discord.Embed(
                 title="🎊 素晴らしい！",
@@ -368,75 +249,27 @@ async def list_tasks(ctx):
             await ctx.send(embed=embed)
             return
 
-        # 期限順にソート
-        user_tasks.sort(key=lambda x: get_urgency_level(x['due_date']))
-
-        # メッセージ分割処理
-        max_tasks_per_message = 5
-        tasks_chunks = [user_tasks[i:i + max_tasks_per_message] for i in range(0, len(user_tasks), max_tasks_per_message)]
-
-        for chunk_index, chunk in enumerate(tasks_chunks):
-            embed = discord.Embed(
-                title=f"📋 {ctx.author.display_name}さんのタスク ({chunk_index + 1}/{len(tasks_chunks)})",
-                color=0x3498db
-            )
-
-            task_list = ""
-            for i, task in enumerate(chunk):
-                global_index = chunk_index * max_tasks_per_message + i + 1
-                due_info = format_due_date(task['due_date'])
-                task_list += f"**{global_index}.** {task['name']}\n"
-                task_list += f"　📅 {due_info}\n"
-                task_list += f"　📝 作成: {task['created']}\n\n"
-
-            embed.description = task_list
-            if chunk_index == len(tasks_chunks) - 1:  # 最後のメッセージにのみフッターを追加
-                embed.set_footer(text="完了: !complete [番号] | 例: !complete 1")
-
-            await ctx.send(embed=embed)
-            if chunk_index < len(tasks_chunks) - 1:  # 最後以外は少し間隔を空ける
-                await asyncio.sleep(1)
+        # 表示中に索引が変わってもページがずれないように、今の一覧を渡す
+        await TaskListView(ctx.author, list(user_tasks)).send(ctx)
 
     except Exception as e:
         await ctx.send(f"❌ エラー: {str(e)}")
         print(f"❌ タスク一覧エラー: {e}")
 
-@bot.command(name='urgent')
+@bot.hybrid_command(name='urgent')
 async def urgent_tasks(ctx):
     """3日以内の緊急タスクを表示"""
     try:
-        sheet = setup_google_sheets()
-        if not sheet:
-            await ctx.send("❌ スプレッドシートに接続できません")
-            return
-
-        all_values = sheet.get_all_values()
+        await ctx.defer()
+        task_table = (await workspaces.for_context(ctx)).table
+        today = datetime.now().date()
+        # 期限切れ〜3日後までのタスク（期限順なので!completeの番号と一致する）
+        urgent_tasks = await task_table.pending_due(str(ctx.author.id), today + timedelta(days=3))
 
-        if len(all_values) <= 1:
+        if task_table.task_count == 0:
             await ctx.send("📋 現在、タスクはありません")
             return
 
-        urgent_tasks = []
-        today = datetime.now().date()
-        
-        for i, row in enumerate(all_values[1:], start=2):
-            if len(row) >= 6 and row[4] == str(ctx.author.id) and row[2] != 'TRUE':
-                due_date = None
-                if len(row) >= 7 and row[6]:
-                    try:
-                        due_date = datetime.strptime(row[6], '%Y-%m-%d').date()
-                    except ValueError:
-                        pass
-                
-                # 3日以内または期限切れのタスクのみ
-                if due_date and (due_date - today).days <= 3:
-                    urgent_tasks.append({
-                        'row': i,
-                        'name': row[0],
-                        'created': row[1],
-                        'due_date': due_date
-                    })
-
         if not urgent_tasks:
             embed = discord.Embed(
                 title="😌 安心してください",
@@ -446,9 +279,6 @@ async def urgent_tasks(ctx):
             await ctx.send(embed=embed)
             return
 
-        # 期限順にソート
-        urgent_tasks.sort(key=lambda x: get_urgency_level(x['due_date']))
-
         embed = discord.Embed(
             title=f"🚨 {ctx.author.display_name}さんの緊急タスク",
             color=0xff0000
@@ -456,8 +286,8 @@ async def urgent_tasks(ctx):
 
         task_list = ""
         for i, task in enumerate(urgent_tasks):
-            due_info = format_due_date(task['due_date'])
-            task_list += f"**{i+1}.** {task['name']}\n"
+            due_info = format_due_date(task.due_date)
+            task_list += f"**{i+1}.** {task.name}\n"
             task_list += f"　📅 {due_info}\n\n"
 
         embed.description = task_list
@@ -469,34 +299,14 @@ async def urgent_tasks(ctx):
         await ctx.send(f"❌ エラー: {str(e)}")
         print(f"❌ 緊急タスク一覧エラー: {e}")
 
-@bot.command(name='today')
+@bot.hybrid_command(name='today')
 async def today_tasks(ctx):
     """今日期限のタスクを表示"""
     try:
-        sheet = setup_google_sheets()
-        if not sheet:
-            await ctx.send("❌ スプレッドシートに接続できません")
-            return
-
-        all_values = sheet.get_all_values()
+        await ctx.defer()
+        task_table = (await workspaces.for_context(ctx)).table
         today = datetime.now().date()
-        today_tasks = []
-        
-        for i, row in enumerate(all_values[1:], start=2):
-            if len(row) >= 6 and row[4] == str(ctx.author.id) and row[2] != 'TRUE':
-                due_date = None
-                if len(row) >= 7 and row[6]:
-                    try:
-                        due_date = datetime.strptime(row[6], '%Y-%m-%d').date()
-                    except ValueError:
-                        pass
-                
-                if due_date == today:
-                    today_tasks.append({
-                        'row': i,
-                        'name': row[0],
-                        'due_date': due_date
-                    })
+        today_tasks = await task_table.pending_due(str(ctx.author.id), today, first=today)
 
         if not today_tasks:
             embed = discord.Embed(
@@ -514,7 +324,7 @@ async def today_tasks(ctx):
 
         task_list = ""
         for i, task in enumerate(today_tasks):
-            task_list += f"**{i+1}.** {task['name']}\n"
+            task_list += f"**{i+1}.** {task.name}\n"
 
         embed.description = task_list
         embed.set_footer(text="完了: !complete [番号] | 例: !complete 1")
@@ -524,43 +334,19 @@ async def today_tasks(ctx):
     except Exception as e:
         await ctx.send(f"❌ エラー: {str(e)}")
 
-@bot.command(name='alltasks')
+@bot.hybrid_command(name='alltasks')
 async def all_tasks(ctx):
     """全体のタスク状況を期限順で表示"""
     try:
-        sheet = setup_google_sheets()
-        if not sheet:
-            await ctx.send("❌ スプレッドシートに接続できません")
-            return
+        await ctx.defer()
+        task_table = (await workspaces.for_context(ctx)).table
+        pending = await task_table.pending()
 
-        all_values = sheet.get_all_values()
-
-        if len(all_values) <= 1:
+        if task_table.task_count == 0:
             await ctx.send("📋 現在、タスクはありません")
             return
 
-        user_tasks = {}
-        for row in all_values[1:]:
-            if len(row) >= 6 and row[2] != 'TRUE':
-                user_name = row[5]
-                task_name = row[0]
-                
-                due_date = None
-                if len(row) >= 7 and row[6]:
-                    try:
-                        due_date = datetime.strptime(row[6], '%Y-%m-%d').date()
-                    except ValueError:
-                        pass
-                
-                if user_name not in user_tasks:
-                    user_tasks[user_name] = []
-                
-                user_tasks[user_name].append({
-                    'name': task_name,
-                    'due_date': due_date
-                })
-
-        if not user_tasks:
+        if not pending:
             embed = discord.Embed(
                 title="🎊 全員完了！",
                 description="すべてのタスクが完了しています！",
@@ -569,169 +355,153 @@ async def all_tasks(ctx):
             await ctx.send(embed=embed)
             return
 
-        # 各ユーザーのタスクを期限順にソート
-        for user_name in user_tasks:
-            user_tasks[user_name].sort(key=lambda x: get_urgency_level(x['due_date']))
-
-        # メッセージ分割処理
-        max_message_length = 1800
-        current_message = "📊 **全体タスク状況**\n\n"
-
-        for user_name, tasks in user_tasks.items():
-            user_section = f"**{user_name}さん ({len(tasks)}件):**\n"
-
-            for i, task in enumerate(tasks):
-                due_info = format_due_date(task['due_date'])
-                task_line = f"• {task['name']} - {due_info}\n"
-                
-                # メッセージ長制限チェック
-                if len(current_message + user_section + task_line) > max_message_length:
-                    # 現在のメッセージを送信
-                    await ctx.send(current_message)
-                    await asyncio.sleep(1)
-                    current_message = "📊 **全体タスク状況（続き）**\n\n"
-                    user_section = f"**{user_name}さん ({len(tasks)}件):**\n"
-
-                user_section += task_line
-
-            user_section += "\n"
-            current_message += user_section
-
-        # 最後のメッセージを送信
-        if current_message.strip():
-            await ctx.send(current_message)
+        await AllTasksView(ctx.author.id, pending).send(ctx)
 
     except Exception as e:
         await ctx.send(f"❌ エラー: {str(e)}")
         print(f"❌ 全タスク一覧エラー: {e}")
 
-@bot.command(name='complete')
-async def complete_task(ctx, task_number: int):
-    """タスクを完了"""
-    try:
-        sheet = setup_google_sheets()
-        if not sheet:
-            await ctx.send("❌ スプレッドシートに接続できません")
-            return
+class TaskNumberOutOfRange(Exception):
+    """指定された番号が1〜タスク数の範囲外"""
+
+def parse_task_numbers(text, count):
+    """「1 3 5-8」のような番号の指定を、1〜countの番号の昇順リストにする
 
-        all_values = sheet.get_all_values()
-
-        user_tasks = []
-        for i, row in enumerate(all_values[1:], start=2):
-            if len(row) >= 6 and row[4] == str(ctx.author.id) and row[2] != 'TRUE':
-                due_date = None
-                if len(row) >= 7 and row[6]:
-                    try:
-                        due_date = datetime.strptime(row[6], '%Y-%m-%d').date()
-                    except ValueError:
-                        pass
-                
-                user_tasks.append({
-                    'row': i,
-                    'name': row[0],
-                    'due_date': due_date
-                })
-
-        # 期限順にソート（!tasksと同じ順序）
-        user_tasks.sort(key=lambda x: get_urgency_level(x['due_date']))
+    区切りは空白かカンマ、範囲は「-」か「〜」（全角の「～」も可）。
+    範囲外の番号があればTaskNumberOutOfRange、数字でなければValueError。
+    """
+    numbers = set()
+    for token in text.replace(',', ' ').replace('、', ' ').split():
+        for separator in ('-', '〜', '～', '~'):
+            if separator in token:
+                first, last = (int(part) for part in token.split(separator, 1))
+                break
+        else:
+            first = last = int(token)
+        if first > last:
+            first, last = last, first
+        if first < 1 or last > count:
+            raise TaskNumberOutOfRange(token)
+        numbers.update(range(first, last + 1))
+    return sorted(numbers)
+
+# /complete の入力補完で選んだタスクの値の先頭
+TASK_CHOICE_PREFIX = 'task:'
+
+def task_choice_value(task):
+    """入力補完の選択肢の値（行番号とタスク名で、選んだ後に一覧が変わっても別のタスクにならない）"""
+    return f"{TASK_CHOICE_PREFIX}{task.row}:{task.name}"[:100]
+
+@bot.hybrid_command(name='complete')
+@app_commands.describe(task_numbers="タスク名（入力すると候補が出ます）または番号（例: 1 3 5-8）")
+async def complete_task(ctx, *, task_numbers):
+    """タスクを完了（複数指定・範囲指定もできる）
+    使用例：
+    !complete 1
+    !complete 1 3 5-8
+    """
+    try:
+        await ctx.defer()
+        task_table = (await workspaces.for_context(ctx)).table
+        # !tasksと同じ期限順の索引（書き込み中に変わらないように今の一覧を使う）
+        user_tasks = list(await task_table.pending_tasks(str(ctx.author.id)))
 
         if not user_tasks:
             await ctx.send("❌ 完了可能なタスクがありません")
             return
 
-        if task_number < 1 or task_number > len(user_tasks):
-            await ctx.send(f"❌ 無効な番号です (1-{len(user_tasks)})")
-            return
-
-        target_task = user_tasks[task_number - 1]
-        target_row = target_task['row']
+        if task_numbers.startswith(TASK_CHOICE_PREFIX):
+            # /complete の候補から選ばれたタスク
+            target_tasks = [task for task in user_tasks if task_choice_value(task) == task_numbers][:1]
+            if not target_tasks:
+                await ctx.send("❌ そのタスクは見つかりません（完了済みか、一覧が変わった可能性があります）")
+                return
+        else:
+            try:
+                numbers = parse_task_numbers(task_numbers, len(user_tasks))
+            except TaskNumberOutOfRange:
+                await ctx.send(f"❌ 無効な番号です (1-{len(user_tasks)})")
+                return
+            except ValueError:
+                numbers = []
+            if not numbers:
+                await ctx.send("❌ 有効な番号を入力してください（例: `!complete 1 3 5-8`）")
+                return
+            target_tasks = [user_tasks[number - 1] for number in numbers]
         now = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
 
-        sheet.update_cell(target_row, 3, 'TRUE')
-        sheet.update_cell(target_row, 4, now)
+        # 全部の行をまとめて1回で書き込む（行番号は書き込む直前に表から読む）
+        target_tasks = await task_table.mark_completed_many(target_tasks, now)
+        if not target_tasks:
+            await ctx.send("❌ そのタスクは見つかりません（完了済みか、一覧が変わった可能性があります）")
+            return
 
-        embed = discord.Embed(
-            title="🎉 タスク完了！",
-            description=f"**{target_task['name']}**\n\nお疲れさまでした！",
-            color=0xffd700
-        )
-        
-        if target_task['due_date']:
-            embed.add_field(
-                name="📅 期限",
-                value=format_due_date(target_task['due_date']),
-                inline=False
+        if len(target_tasks) == 1:
+            target_task = target_tasks[0]
+            embed = discord.Embed(
+                title="🎉 タスク完了！",
+                description=f"**{target_task.name}**\n\nお疲れさまでした！",
+                color=0xffd700
             )
-        
+
+            if target_task.due_date:
+                embed.add_field(
+                    name="📅 期限",
+                    value=format_due_date(target_task.due_date),
+                    inline=False
+                )
+        else:
+            task_list = ""
+            for i, task in enumerate(target_tasks):
+                line = f"• **{task.name}**\n"
+                if len(task_list) + len(line) > 3900:  # 埋め込みの説明は4096文字まで
+                    task_list += f"• ... 他{len(target_tasks) - i}件\n"
+                    break
+                task_list += line
+            embed = discord.Embed(
+                title=f"🎉 {len(target_tasks)}件のタスク完了！",
+                description=f"{task_list}\nお疲れさまでした！",
+                color=0xffd700
+            )
+
         embed.set_author(name=ctx.author.display_name)
 
         await ctx.send(embed=embed)
-        print(f"✅ タスク完了: {target_task['name']} by {ctx.author.display_name}")
+        print(f"✅ タスク完了: {', '.join(task.name for task in target_tasks)} by {ctx.author.display_name}")
 
-    except ValueError:
-        await ctx.send("❌ 有効な番号を入力してください")
     except Exception as e:
         await ctx.send(f"❌ エラー: {str(e)}")
         print(f"❌ タスク完了エラー: {e}")
 
-@bot.command(name='taskstats')
+@complete_task.autocomplete('task_numbers')
+async def complete_task_autocomplete(interaction, current):
+    """/complete の候補（メモリ上の索引だけで答え、シートは読まない）"""
+    # 入力補完では接続しない（まだ開いていないスプレッドシートなら候補なし）
+    workspace = workspaces.cached(interaction.guild_id, interaction.channel_id)
+    index = workspace.table.name_index(str(interaction.user.id)) if workspace else None
+    if index is None:
+        return []
+    return [
+        app_commands.Choice(name=f"{task.name} - {format_due_date(task.due_date)}"[:100], value=task_choice_value(task))
+        for task in index.search(current)
+    ]
+
+@bot.hybrid_command(name='taskstats')
 async def task_stats(ctx):
     """タスク統計情報を表示"""
     try:
-        sheet = setup_google_sheets()
-        if not sheet:
-            await ctx.send("❌ スプレッドシートに接続できません")
-            return
-
-        all_values = sheet.get_all_values()
+        await ctx.defer()
+        task_table = (await workspaces.for_context(ctx)).table
+        today = datetime.now().date()
+        # ユーザーごとの件数は追加・完了のたびに更新されている（期限切れ・緊急は日付ごとに集計）
+        user_counts, due_counts = await task_table.stats(today)
 
-        if len(all_values) <= 1:
+        if task_table.task_count == 0:
             await ctx.send("📊 まだタスクが登録されていません")
             return
 
-        total_tasks = 0
-        completed_tasks = 0
-        user_stats = {}
-        today = datetime.now().date()
-
-        for row in all_values[1:]:
-            if len(row) >= 6:
-                user_name = row[5]
-                is_completed = row[2] == 'TRUE'
-
-                # 期限情報
-                due_date = None
-                if len(row) >= 7 and row[6]:
-                    try:
-                        due_date = datetime.strptime(row[6], '%Y-%m-%d').date()
-                    except ValueError:
-                        pass
-
-                if user_name not in user_stats:
-                    user_stats[user_name] = {
-                        'total': 0, 
-                        'completed': 0, 
-                        'pending': 0,
-                        'overdue': 0,
-                        'urgent': 0
-                    }
-
-                user_stats[user_name]['total'] += 1
-                total_tasks += 1
-
-                if is_completed:
-                    user_stats[user_name]['completed'] += 1
-                    completed_tasks += 1
-                else:
-                    user_stats[user_name]['pending'] += 1
-                    
-                    # 期限切れ・緊急タスクのカウント
-                    if due_date:
-                        diff = (due_date - today).days
-                        if diff < 0:
-                            user_stats[user_name]['overdue'] += 1
-                        elif diff <= 3:
-                            user_stats[user_name]['urgent'] += 1
+        total_tasks = task_table.task_count
+        completed_tasks = task_table.completed_count
 
         embed = discord.Embed(
             title="📊 タスク統計",
@@ -748,15 +518,18 @@ async def task_stats(ctx):
 
         # ユーザー別統計
         user_stats_text = ""
-        for user_name, stats in user_stats.items():
-            user_completion_rate = (stats['completed'] / stats['total'] * 100) if stats['total'] > 0 else 0
+        for user_name, (total, completed) in user_counts.items():
+            if total == 0:
+                continue
+            overdue, urgent = due_counts.get(user_name, (0, 0))
+            user_completion_rate = completed / total * 100
             urgent_info = ""
-            if stats['overdue'] > 0:
-                urgent_info += f" 🔴{stats['overdue']}件期限切れ"
-            if stats['urgent'] > 0:
-                urgent_info += f" 🟡{stats['urgent']}件緊急"
+            if overdue > 0:
+                urgent_info += f" 🔴{overdue}件期限切れ"
+            if urgent > 0:
+                urgent_info += f" 🟡{urgent}件緊急"
             
-            user_stats_text += f"**{user_name}**: {stats['pending']}件未完了 ({user_completion_rate:.1f}%完了){urgent_info}\n"
+            user_stats_text += f"**{user_name}**: {total - completed}件未完了 ({user_completion_rate:.1f}%完了){urgent_info}\n"
 
         embed.add_field(
             name="👥 ユーザー別",
@@ -773,21 +546,14 @@ async def task_stats(ctx):
 async def clear_completed_tasks(ctx):
     """完了済みタスクを削除（管理者用）"""
     try:
-        sheet = setup_google_sheets()
-        if not sheet:
-            await ctx.send("❌ スプレッドシートに接続できません")
-            return
-
-        all_values = sheet.get_all_values()
-        if len(all_values) <= 1:
+        task_table = (await workspaces.for_context(ctx)).table
+        await task_table.ensure_fresh()
+        if task_table.task_count == 0:
             await ctx.send("📋 削除するタスクがありません")
             return
 
-        # 完了済みタスクをカウント
-        completed_count = 0
-        for row in all_values[1:]:
-            if len(row) >= 3 and row[2] == 'TRUE':
-                completed_count += 1
+        # 完了済みタスクの数（追加・完了のたびに更新されている）
+        completed_count = task_table.completed_count
 
         if completed_count == 0:
             await ctx.send("✅ 完了済みタスクはありません")
@@ -808,19 +574,13 @@ async def clear_completed_tasks(ctx):
             response = await bot.wait_for('message', check=check, timeout=30.0)
 
             if response.content.lower() == 'yes':
-                # ヘッダーと未完了タスクのみを保持
-                new_data = [all_values[0]]  # ヘッダー行
-                for row in all_values[1:]:
-                    if len(row) >= 3 and row[2] != 'TRUE':
-                        new_data.append(row)
-
-                # シートをクリアして新しいデータを書き込み
-                sheet.clear()
-                sheet.update('A1', new_data)
+                # ヘッダーと未完了タスクのみを残してシートを書き換え
+                # （確認待ちの間に追加・完了されたタスクも反映される）
+                removed_count = await task_table.clear_completed()
 
                 embed = discord.Embed(
                     title="🗑️ 削除完了",
-                    description=f"{completed_count}件の完了済みタスクを削除しました",
+                    description=f"{removed_count}件の完了済みタスクを削除しました",
                     color=0x00ff00
                 )
                 await ctx.send(embed=embed)
@@ -833,248 +593,119 @@ async def clear_completed_tasks(ctx):
     except Exception as e:
         await ctx.send(f"❌ 削除エラー: {str(e)}")
 
-@tasks.loop(time=time(hour=0, minute=0))  # 日本時間の朝9時の場合は hour=0 (UTC)
-async def daily_reminder():
-    try:
-        channel_id = os.environ.get('NOTIFICATION_CHANNEL_ID')
-        if not channel_id:
-            print("⚠️ 通知チャンネルIDが設定されていません")
-            return
-
-        channel = bot.get_channel(int(channel_id))
-        if not channel:
-            print("⚠️ 通知チャンネルが見つかりません")
-            return
-
-        sheet = setup_google_sheets()
-        if not sheet:
-            print("❌ スプレッドシートに接続できません")
-            return
-
-        all_values = sheet.get_all_values()
-
-        if len(all_values) <= 1:
-            return
-
-        # ユーザーごとのタスク情報を収集
-        user_tasks = {}
-        today = datetime.now().date()
-
-        for row in all_values[1:]:
-            if len(row) >= 6 and row[2] != 'TRUE':  # 未完了タスクのみ
-                user_name = row[5]
-                task_name = row[0]
-                created_date = row[1]
-                
-                due_date = None
-                if len(row) >= 7 and row[6]:
-                    try:
-                        due_date = datetime.strptime(row[6], '%Y-%m-%d').date()
-                    except ValueError:
-                        pass
-                
-                if user_name not in user_tasks:
-                    user_tasks[user_name] = []
-                
-                user_tasks[user_name].append({
-                    'name': task_name,
-                    'created': created_date,
-                    'due_date': due_date
-                })
+async def send_digest(destination, digest, title, footer):
+    """毎朝通知の本文を送る（未完了タスクがなければその旨を送ってFalseを返す）"""
+    fields = digest.fields()
+    first = await anext(fields, None)
+    if first is None:
+        embed = discord.Embed(
+            title=title,
+            description="現在、未完了のタスクはありません！\n今日も素晴らしい一日を！",
+            color=0x00ff00
+        )
+        await destination.send(embed=embed)
+        return False
 
-        if not user_tasks:
-            embed = discord.Embed(
-                title="🌅 おはようございます！",
-                description="現在、未完了のタスクはありません！\n今日も素晴らしい一日を！",
-                color=0x00ff00
-            )
-            await channel.send(embed=embed)
-            return
+    async def all_fields():
+        yield first
+        async for field in fields:
+            yield field
 
-        # 各ユーザーのタスクを期限順にソート
-        for user_name in user_tasks:
-            user_tasks[user_name].sort(key=lambda x: get_urgency_level(x['due_date']))
+    # 埋め込みがいっぱいになるたびに送る（ユーザーが多いと複数に分かれる）
+    async for embed in stream_embeds(all_fields(), title, "今日のタスク状況をお知らせします", footer):
+        await destination.send(embed=embed)
+    return True
 
-        # メイン通知メッセージ
-        embed = discord.Embed(
-            title="🌅 おはようございます！",
-            description="今日のタスク状況をお知らせします",
-            color=0xff9500
-        )
+@tasks.loop(time=time(hour=0, minute=0))  # 日本時間の朝9時の場合は hour=0 (UTC)
+async def daily_reminder():
+    metrics.set_current_command('daily_reminder')
+    # シートの読み書きはコマンドの後に回す
+    set_background()
+    metrics.daily_reminder_last_run.set(datetime.now().timestamp())
+    with metrics.daily_reminder_duration.time():
+        try:
+            channel_id = os.environ.get('NOTIFICATION_CHANNEL_ID')
+            if not channel_id:
+                print("⚠️ 通知チャンネルIDが設定されていません")
+                return
 
-        # ユーザーごとにタスクを表示（上位5件まで）
-        for user_name, tasks in user_tasks.items():
-            task_count = len(tasks)
-            
-            # 緊急・期限切れタスクの数をカウント
-            urgent_count = 0
-            overdue_count = 0
-            for task in tasks:
-                if task['due_date']:
-                    diff = (task['due_date'] - today).days
-                    if diff < 0:
-                        overdue_count += 1
-                    elif diff <= 3:
-                        urgent_count += 1
-            
-            # タスクリストを作成（最大5件、緊急タスクを優先表示）
-            task_list = ""
-            for i, task in enumerate(tasks[:5]):  # 上から5つまで
-                due_info = format_due_date(task['due_date'])
-                task_list += f"• {task['name']} - {due_info}\n"
-            
-            # 5件を超える場合は「他○件」を追加
-            if task_count > 5:
-                task_list += f"• ... 他{task_count - 5}件\n"
-            
-            # フィールドタイトルに緊急情報を追加
-            field_title = f"📝 {user_name}さん ({task_count}件"
-            if overdue_count > 0:
-                field_title += f", 🔴{overdue_count}件期限切れ"
-            elif urgent_count > 0:
-                field_title += f", 🟡{urgent_count}件緊急"
-            field_title += ")"
-            
-            # フィールドに追加
-            embed.add_field(
-                name=field_title,
-                value=task_list if task_list else "タスクなし",
-                inline=False
-            )
+            channel = bot.get_channel(int(channel_id))
+            if not channel:
+                print("⚠️ 通知チャンネルが見つかりません")
+                return
 
-        # フッターにコマンド案内を追加
-        embed.add_field(
-            name="📱 便利なコマンド",
-            value="`!tasks` - 自分のタスク確認\n`!urgent` - 緊急タスクのみ\n`!today` - 今日期限のタスク\n`!complete [番号]` - タスク完了",
-            inline=False
-        )
+            # 通知チャンネルのギルドのスプレッドシート（ループのタスクは終わらないので使う間だけ借りる）
+            guild = getattr(channel, 'guild', None)
+            async with workspaces.lease(guild.id if guild else None, channel.id) as workspace:
+                task_table = workspace.table
+                await task_table.ensure_fresh()
 
-        embed.set_footer(text="今日も頑張りましょう！💪")
+                if task_table.task_count == 0:
+                    return
 
-        await channel.send(embed=embed)
-        print("📢 毎日通知を送信しました")
+                if await send_digest(channel, workspace.digest, "🌅 おはようございます！", "今日も頑張りましょう！💪"):
+                    print("📢 毎日通知を送信しました")
 
-    except Exception as e:
-        print(f"❌ 毎日通知エラー: {e}")
+        except Exception as e:
+            print(f"❌ 毎日通知エラー: {e}")
 
 @bot.command(name='testreminder')
 async def test_reminder(ctx):
     """毎朝通知のテスト実行"""
     try:
+        workspace = await workspaces.for_context(ctx)
+        task_table = workspace.table
         await ctx.send("🧪 **毎朝通知のテストを実行します**")
         
-        sheet = setup_google_sheets()
-        if not sheet:
-            await ctx.send("❌ スプレッドシートに接続できません")
-            return
+        await task_table.ensure_fresh()
 
-        all_values = sheet.get_all_values()
-
-        if len(all_values) <= 1:
+        if task_table.task_count == 0:
             await ctx.send("📊 テスト結果: タスクが登録されていません")
             return
 
-        # ユーザーごとのタスク情報を収集
-        user_tasks = {}
-        today = datetime.now().date()
-
-        for row in all_values[1:]:
-            if len(row) >= 6 and row[2] != 'TRUE':  # 未完了タスクのみ
-                user_name = row[5]
-                task_name = row[0]
-                created_date = row[1]
-                
-                due_date = None
-                if len(row) >= 7 and row[6]:
-                    try:
-                        due_date = datetime.strptime(row[6], '%Y-%m-%d').date()
-                    except ValueError:
-                        pass
-                
-                if user_name not in user_tasks:
-                    user_tasks[user_name] = []
-                
-                user_tasks[user_name].append({
-                    'name': task_name,
-                    'created': created_date,
-                    'due_date': due_date
-                })
+        if await send_digest(ctx, workspace.digest, "🌅 おはようございます！（テスト）", "テスト実行完了！💪"):
+            await ctx.send("✅ **テスト完了！** この形式で毎朝通知されます")
 
-        if not user_tasks:
-            embed = discord.Embed(
-                title="🌅 おはようございます！（テスト）",
-                description="現在、未完了のタスクはありません！\n今日も素晴らしい一日を！",
-                color=0x00ff00
-            )
-            await ctx.send(embed=embed)
-            return
-
-        # 各ユーザーのタスクを期限順にソート
-        for user_name in user_tasks:
-            user_tasks[user_name].sort(key=lambda x: get_urgency_level(x['due_date']))
+    except Exception as e:
+        await ctx.send(f"❌ テストエラー: {str(e)}")
+        print(f"❌ テスト通知エラー: {e}")
 
-        # メイン通知メッセージ
-        embed = discord.Embed(
-            title="🌅 おはようございます！（テスト）",
-            description="今日のタスク状況をお知らせします",
-            color=0xff9500
-        )
+@bot.command(name='reloadtasks')
+async def reload_tasks(ctx):
+    """タスクのキャッシュを破棄してシートから読み直す（シートを直接編集した時用）"""
+    try:
+        task_table = (await workspaces.for_context(ctx)).table
+        task_table.invalidate()
+        await task_table.ensure_fresh()
+        await ctx.send(f"🔄 スプレッドシートから再読込しました ({task_table.task_count}件)")
+    except Exception as e:
+        await ctx.send(f"❌ 再読込エラー: {str(e)}")
 
-        # ユーザーごとにタスクを表示（上位5件まで）
-        for user_name, tasks in user_tasks.items():
-            task_count = len(tasks)
-            
-            # 緊急・期限切れタスクの数をカウント
-            urgent_count = 0
-            overdue_count = 0
-            for task in tasks:
-                if task['due_date']:
-                    diff = (task['due_date'] - today).days
-                    if diff < 0:
-                        overdue_count += 1
-                    elif diff <= 3:
-                        urgent_count += 1
-            
-            # タスクリストを作成（最大5件、緊急タスクを優先表示）
-            task_list = ""
-            for i, task in enumerate(tasks[:5]):  # 上から5つまで
-                due_info = format_due_date(task['due_date'])
-                task_list += f"• {task['name']} - {due_info}\n"
-            
-            # 5件を超える場合は「他○件」を追加
-            if task_count > 5:
-                task_list += f"• ... 他{task_count - 5}件\n"
-            
-            # フィールドタイトルに緊急情報を追加
-            field_title = f"📝 {user_name}さん ({task_count}件"
-            if overdue_count > 0:
-                field_title += f", 🔴{overdue_count}件期限切れ"
-            elif urgent_count > 0:
-                field_title += f", 🟡{urgent_count}件緊急"
-            field_title += ")"
-            
-            # フィールドに追加
-            embed.add_field(
-                name=field_title,
-                value=task_list if task_list else "タスクなし",
-                inline=False
-            )
+@bot.command(name='perf')
+async def perf(ctx):
+    """イベントループの遅れと、止まった時の記録を表示（管理者用）"""
+    age = heartbeat_age(bot)
+    embed = discord.Embed(
+        title="⏱️ パフォーマンス",
+        description=(
+            f"ループの遅れ: {loop_monitor.lag * 1000:.1f}ms（最大 {loop_monitor.max_lag * 1000:.1f}ms）\n"
+            f"ハートビート: {f'{age:.1f}秒前' if age is not None else '未接続'}\n"
+            f"記録した停止: {len(loop_monitor.stalls)}件（{loop_monitor.stall_threshold}秒以上）"
+        ),
+        color=0x3498db
+    )
 
-        # フッターにコマンド案内を追加
+    # 新しい順に5件まで
+    for stall in list(loop_monitor.stalls)[::-1][:5]:
+        calls = ', '.join(f"{label}×{count}" for label, count in stall.sheets_calls.items()) or 'なし'
+        stack = ''.join(stall.stack[-3:])[-700:]
         embed.add_field(
-            name="📱 便利なコマンド",
-            value="`!tasks` - 自分のタスク確認\n`!urgent` - 緊急タスクのみ\n`!today` - 今日期限のタスク\n`!complete [番号]` - タスク完了",
+            name=f"🐢 {stall.started_at.strftime('%m/%d %H:%M:%S')} {stall.duration:.2f}秒 ({stall.command or '不明'})",
+            value=f"シート呼び出し: {calls}\n```{stack}```",
             inline=False
         )
 
-        embed.set_footer(text="テスト実行完了！💪")
-
-        await ctx.send(embed=embed)
-        await ctx.send("✅ **テスト完了！** この形式で毎朝通知されます")
-
-    except Exception as e:
-        await ctx.send(f"❌ テストエラー: {str(e)}")
-        print(f"❌ テスト通知エラー: {e}")
+    await ctx.send(embed=embed)
 
 @bot.command(name='taskhelp')
 async def help_command(ctx):
@@ -1086,7 +717,7 @@ async def help_command(ctx):
 
     embed.add_field(
         name="📝 基本コマンド",
-        value="`!addtask [内容]` - タスク追加（期限なし）\n`!addtask [内容] [期限]` - 期限付きタスク追加\n`!tasks` - 自分のタスク確認（期限順）\n`!complete [番号]` - タスク完了",
+        value="`!addtask [内容]` - タスク追加（期限なし）\n`!addtask [内容] [期限]` - 期限付きタスク追加\n`!addtasks` + 改行区切りの複数行 - まとめて追加\n`!tasks` - 自分のタスク確認（期限順）\n`!complete [番号]` - タスク完了（`!complete 1 3 5-8` でまとめて完了）",
         inline=False
     )
 
@@ -1104,7 +735,7 @@ async def help_command(ctx):
 
     embed.add_field(
         name="🔧 管理コマンド",
-        value="`!clearcompleted` - 完了済みタスク削除\n`!testreminder` - 通知テスト",
+        value="`!clearcompleted` - 完了済みタスク削除\n`!testreminder` - 通知テスト\n`!reloadtasks` - シートから再読込\n`!perf` - 処理の遅れの記録",
         inline=False
     )
 
@@ -1132,8 +763,12 @@ async def test_connection(ctx):
     try:
         await ctx.send("🔍 **Google Sheets接続テスト開始**")
 
+        # このギルド・チャンネルが使うスプレッドシートを調べる
+        workspace = await workspaces.for_context(ctx, ready=False)
+        sheets = workspace.sheets
+        spreadsheet_id, sheet_name = workspace.target.spreadsheet_id, workspace.target.sheet_name
+
         # 1. 環境変数確認
-        spreadsheet_id = os.environ.get('SPREADSHEET_ID')
         google_key = os.environ.get('GOOGLE_SERVICE_KEY')
 
         if not spreadsheet_id:
@@ -1163,7 +798,7 @@ async def test_connection(ctx):
                 'https://www.googleapis.com/auth/drive'
             ]
             creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict, scope)
-            client = gspread.authorize(creds)
+            client = await sheets.run_sync('authorize', gspread.authorize, creds)
             await ctx.send("✅ Google認証: 成功")
         except Exception as auth_error:
             await ctx.send(f"❌ Google認証エラー: {str(auth_error)}")
@@ -1171,12 +806,12 @@ async def test_connection(ctx):
 
         # 4. スプレッドシート接続テスト
         try:
-            spreadsheet = client.open_by_key(spreadsheet_id)
+            spreadsheet = await sheets.run_sync('open_by_key', client.open_by_key, spreadsheet_id)
             await ctx.send(f"✅ スプレッドシート接続: 成功")
             await ctx.send(f"📝 スプレッドシート名: `{spreadsheet.title}`")
 
             # 全シート一覧
-            worksheets = spreadsheet.worksheets()
+            worksheets = await sheets.run_sync('worksheets', spreadsheet.worksheets)
             sheet_names = [ws.title for ws in worksheets]
             await ctx.send(f"📄 利用可能なシート: {sheet_names}")
 
@@ -1190,24 +825,24 @@ async def test_connection(ctx):
 
         # 5. ワークシート接続テスト
         try:
-            worksheet = spreadsheet.worksheet(SHEET_NAME)
-            await ctx.send(f"✅ ワークシート '{SHEET_NAME}': 存在")
+            worksheet = await sheets.run_sync('worksheet', spreadsheet.worksheet, sheet_name)
+            await ctx.send(f"✅ ワークシート '{sheet_name}': 存在")
 
             # データ確認
-            all_values = worksheet.get_all_values()
+            all_values = await sheets.run_sync('get_all_values', worksheet.get_all_values)
             await ctx.send(f"📊 データ行数: {len(all_values)}")
 
             if len(all_values) > 0:
                 await ctx.send(f"📋 ヘッダー: {all_values[0]}")
 
         except gspread.WorksheetNotFound:
-            await ctx.send(f"⚠️ ワークシート '{SHEET_NAME}' が存在しません")
+            await ctx.send(f"⚠️ ワークシート '{sheet_name}' が存在しません")
             await ctx.send("🔧 **自動作成を試行中...**")
 
             try:
-                new_sheet = spreadsheet.add_worksheet(title=SHEET_NAME, rows=1000, cols=10)
-                new_sheet.append_row(['タスク名', '作成日', '完了', '完了日', 'ユーザーID', 'ユーザー名', '期限'])
-                await ctx.send(f"✅ ワークシート '{SHEET_NAME}' を作成しました")
+                new_sheet = await sheets.run_sync('add_worksheet', spreadsheet.add_worksheet, title=sheet_name, rows=1000, cols=10)
+                await sheets.run_sync('append_row', new_sheet.append_row, ['タスク名', '作成日', '完了', '完了日', 'ユーザーID', 'ユーザー名', '期限'])
+                await ctx.send(f"✅ ワークシート '{sheet_name}' を作成しました")
             except Exception as create_error:
                 await ctx.send(f"❌ ワークシート作成エラー: {str(create_error)}")
                 return
@@ -1228,46 +863,45 @@ async def fix_sheet(ctx):
     try:
         await ctx.send("🔧 **シート修復開始**")
 
-        # Google Sheets接続
-        credentials_json = os.environ.get('GOOGLE_SERVICE_KEY')
-        credentials_dict = json.loads(credentials_json)
-        scope = [
-            'https://spreadsheets.google.com/feeds',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict, scope)
-        client = gspread.authorize(creds)
-        spreadsheet = client.open_by_key(SPREADSHEET_ID)
+        # このギルド・チャンネルのスプレッドシートの接続を再接続して使う
+        workspace = await workspaces.for_context(ctx, ready=False)
+        sheets, sheet_name = workspace.sheets, workspace.target.sheet_name
+        workspace.session.reset()
+        if not await sheets.connect():
+            await ctx.send("❌ スプレッドシートに接続できません")
+            return
+        spreadsheet = workspace.session.spreadsheet
 
         await ctx.send(f"✅ スプレッドシート接続: {spreadsheet.title}")
 
         # tasksシートの存在確認
         try:
-            worksheet = spreadsheet.worksheet(SHEET_NAME)
-            await ctx.send(f"✅ '{SHEET_NAME}' シートは存在します")
+            worksheet = await sheets.run_sync('worksheet', spreadsheet.worksheet, sheet_name)
+            await ctx.send(f"✅ '{sheet_name}' シートは存在します")
 
             # ヘッダー確認
-            headers = worksheet.row_values(1)
+            headers = await sheets.run_sync('row_values', worksheet.row_values, 1)
             expected_headers = ['タスク名', '作成日', '完了', '完了日', 'ユーザーID', 'ユーザー名', '期限']
 
             if len(headers) < 7:
                 await ctx.send("🔧 期限フィールドを追加中...")
-                worksheet.update_cell(1, 7, '期限')
+                await sheets.run_sync('update_cell', worksheet.update_cell, 1, 7, '期限')
                 await ctx.send("✅ 期限フィールド追加完了")
             elif headers != expected_headers:
                 await ctx.send("🔧 ヘッダーを修正中...")
-                worksheet.clear()
-                worksheet.append_row(expected_headers)
+                await sheets.run_sync('clear', worksheet.clear)
+                await sheets.run_sync('append_row', worksheet.append_row, expected_headers)
                 await ctx.send("✅ ヘッダー修正完了")
             else:
                 await ctx.send("✅ ヘッダーは正常です")
 
         except gspread.WorksheetNotFound:
-            await ctx.send(f"⚠️ '{SHEET_NAME}' シートが見つかりません - 作成中...")
-            worksheet = spreadsheet.add_worksheet(title=SHEET_NAME, rows=1000, cols=10)
-            worksheet.append_row(['タスク名', '作成日', '完了', '完了日', 'ユーザーID', 'ユーザー名', '期限'])
+            await ctx.send(f"⚠️ '{sheet_name}' シートが見つかりません - 作成中...")
+            worksheet = await sheets.run_sync('add_worksheet', spreadsheet.add_worksheet, title=sheet_name, rows=1000, cols=10)
+            await sheets.run_sync('append_row', worksheet.append_row, ['タスク名', '作成日', '完了', '完了日', 'ユーザーID', 'ユーザー名', '期限'])
             await ctx.send("✅ シート作成完了")
 
+        workspace.table.invalidate()
         await ctx.send("🎉 **修復完了！** 期限機能付きコマンドを試してください")
 
     except Exception as e:
@@ -1290,10 +924,11 @@ if __name__ == "__main__":
     else:
         print("🚀 Botを起動中...")
 
-        # FlaskサーバーをバックグラウンドでStart
-        flask_thread = threading.Thread(target=run_flask, daemon=True)
-        flask_thread.start()
-        print("🌐 Webサーバー起動完了 (ポート: 8080)")
+        # FlaskサーバーをバックグラウンドでStart（asyncの時はsetup_hookで起動）
+        if HEALTH_SERVER == 'flask':
+            flask_thread = threading.Thread(target=run_flask, daemon=True)
+            flask_thread.start()
+            print("🌐 Webサーバー起動完了 (ポート: 8080)")
 
         # DiscordBot起動
         bot.run(token)
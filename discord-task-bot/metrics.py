@@ -0,0 +1,303 @@
+"""Prometheus形式のメトリクス（外部ライブラリなし）
+
+コマンドやシート呼び出しのたびに呼ばれるので、記録はカウンターの加算と
+二分探索だけにしてある。ラベルの組み合わせごとの子を作る時と、/metrics で
+出力する時だけロックを取る（出力はFlaskのスレッドから呼ばれることがあるため）。
+"""
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# 実行中のコマンド名（シート呼び出しをどのコマンドが行ったか数えるのに使う）
+current_command = contextvars.ContextVar('current_command', default=None)
+# 送信の時間を計測中か（ctx.sendの中のMessageable.sendを二重に数えない）
+_timing_send = contextvars.ContextVar('_timing_send', default=False)
+# 実行中のasyncioタスク → コマンド名（別スレッドからループの様子を調べる時に使う）
+running_commands = {}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        """ラベルの値に対応する子を返す（なければ作る）"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ラベルの数が違います {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def _render_child(self, values, child):
+        yield f'{self.name}{self._label_text(values)} {_format(child.value)}'
+
+
+class _GaugeChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def _render_child(self, values, child):
+        yield f'{self.name}{self._label_text(values)} {_format(child.value)}'
+
+
+class _HistogramChild:
+    __slots__ = ('upper_bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _render_child(self, values, child):
+        cumulative = 0
+        for upper_bound, count in zip(self.upper_bounds + (float('inf'),), child.counts):
+            cumulative += count
+            le = '+Inf' if upper_bound == float('inf') else _format(upper_bound)
+            yield f'{self.name}_bucket{self._label_text(values, [("le", le)])} {cumulative}'
+        yield f'{self.name}_sum{self._label_text(values)} {_format(child.sum)}'
+        yield f'{self.name}_count{self._label_text(values)} {child.count}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        """Prometheusのテキスト形式で全メトリクスを返す"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = Registry()
+
+command_duration = registry.histogram(
+    'bot_command_duration_seconds', 'コマンドの処理時間', ['command'])
+command_errors = registry.counter(
+    'bot_command_errors_total', 'エラーになったコマンドの数', ['command'])
+command_sheets_calls = registry.counter(
+    'bot_command_sheets_calls_total', 'コマンドごとのシート呼び出し回数', ['command'])
+sheets_call_duration = registry.histogram(
+    'sheets_call_duration_seconds', 'シート呼び出し（gspread）1回あたりの時間', ['method'])
+sheets_call_errors = registry.counter(
+    'sheets_call_errors_total', '失敗したシート呼び出しの数', ['method', 'error'])
+sheets_call_retries = registry.counter(
+    'sheets_call_retries_total', '429/5xxで再試行したシート呼び出しの数', ['method', 'status'])
+sheets_queue_wait = registry.histogram(
+    'sheets_queue_wait_seconds', 'シート呼び出しが上限のために待った時間', ['kind'])
+sheets_queue_waiting = registry.gauge(
+    'sheets_queue_waiting', '上限のために待っているシート呼び出しの数', ['kind'])
+discord_send_duration = registry.histogram(
+    'discord_send_duration_seconds', 'Discordへのメッセージ送信の時間')
+cache_requests = registry.counter(
+    'cache_requests_total', 'キャッシュの参照（result=hit/miss/sync）', ['cache', 'result'])
+daily_reminder_duration = registry.histogram(
+    'daily_reminder_duration_seconds', '毎朝通知1回の処理時間',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+daily_reminder_last_run = registry.gauge(
+    'daily_reminder_last_run_timestamp_seconds', '毎朝通知を最後に実行した時刻（UNIX時間）')
+loop_lag = registry.gauge(
+    'event_loop_lag_seconds', 'イベントループの遅れ（直近の計測値）')
+loop_stalls = registry.counter(
+    'event_loop_stalls_total', 'しきい値を超えてイベントループが止まった回数')
+
+
+def instrument_bot(bot):
+    """全コマンドの処理時間・エラー数を記録するフックを登録する"""
+
+    @bot.before_invoke
+    async def _start_timer(ctx):
+        ctx.metrics_started = time.perf_counter()
+        set_current_command(ctx.command.qualified_name)
+
+    @bot.after_invoke
+    async def _observe(ctx):
+        started = getattr(ctx, 'metrics_started', None)
+        if started is None:
+            return
+        name = ctx.command.qualified_name
+        command_duration.labels(name).observe(time.perf_counter() - started)
+        if ctx.command_failed:
+            command_errors.labels(name).inc()
+
+
+def set_current_command(name):
+    """今のタスクで実行中のコマンド名を設定する（タスクが終われば消える）"""
+    current_command.set(name)
+    task = asyncio.current_task()
+    if task is not None:
+        if task not in running_commands:
+            task.add_done_callback(_forget_task)
+        running_commands[task] = name
+
+
+def _forget_task(task):
+    running_commands.pop(task, None)
+
+
+def instrument_send(*classes):
+    """各クラスのsendの時間を記録するようにする
+
+    Messageable（channel.send / プレフィックスコマンドのctx.send）と、
+    スラッシュコマンドの応答・フォローアップも送るContextの両方に付ける。
+    入れ子になった呼び出しは外側の1回だけ数える。
+    """
+    for cls in classes:
+        original = cls.__dict__.get('send')
+        if original is None or getattr(original, '_metrics_wrapped', False):
+            continue
+        cls.send = _timed_send(original)
+
+
+def _timed_send(original):
+    async def send(self, *args, **kwargs):
+        if _timing_send.get():
+            return await original(self, *args, **kwargs)
+        token = _timing_send.set(True)
+        started = time.perf_counter()
+        try:
+            return await original(self, *args, **kwargs)
+        finally:
+            discord_send_duration.observe(time.perf_counter() - started)
+            _timing_send.reset(token)
+
+    send._metrics_wrapped = True
+    send.__doc__ = original.__doc__
+    return send
+
+
+def record_sheets_call(method, seconds, error=None):
+    """シート呼び出し1回分を記録（SheetsGatewayから呼ぶ）"""
+    sheets_call_duration.labels(method).observe(seconds)
+    if error is not None:
+        sheets_call_errors.labels(method, type(error).__name__).inc()
+    command = current_command.get()
+    if command:
+        command_sheets_calls.labels(command).inc()
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
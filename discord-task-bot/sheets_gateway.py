@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import cache_requests, record_sheets_call
+from sheets_scheduler import RequestScheduler, classify
+
+# gspread呼び出しを実行するワーカースレッド数
+SHEETS_MAX_WORKERS = int(os.environ.get('SHEETS_MAX_WORKERS', '4'))
+# 1回の呼び出しを待つ最大秒数
+SHEETS_CALL_TIMEOUT = float(os.environ.get('SHEETS_CALL_TIMEOUT', '30'))
+
+
+class SheetsTimeout(Exception):
+    """スプレッドシートの応答がタイムアウトした"""
+
+
+class SheetsGateway:
+    """gspreadの同期呼び出しをワーカースレッドで実行する非同期ゲートウェイ
+
+    コマンドや定期タスクからはこのクラス経由でシートにアクセスし、
+    HTTP通信の間もdiscord.pyのイベントループを止めないようにする。
+    呼び出しはRequestSchedulerを通すので、1分あたりの上限を超えそうな時は
+    エラーにならずに順番待ちになり、429/5xxは自動で再試行される。
+    同じ読み取りが同時に呼ばれた時は、最初の呼び出しの結果を全員で使う。
+    """
+
+    def __init__(self, session, max_workers=SHEETS_MAX_WORKERS, timeout=SHEETS_CALL_TIMEOUT, scheduler=None):
+        self.session = session
+        self.timeout = timeout
+        self.scheduler = scheduler or RequestScheduler()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sheets')
+        # 実行中の呼び出し（label → 件数）。ループが止まった時の記録に使う
+        self.in_flight = Counter()
+        # 実行中の読み取り（呼び出し内容 → タスク）
+        self._reads = {}
+        # タイムアウトした後もワーカースレッドで実行が続いている呼び出し
+        self._stragglers = set()
+
+    async def run_sync(self, label, func, *args, timeout=None, **kwargs):
+        """任意の同期関数をワーカースレッドで実行する
+
+        labelはメソッド名（読み取り/書き込みの判定とタイムアウト時の表示に使う）。
+        """
+        return await self.scheduler.run(
+            label, lambda: self._run_once(label, functools.partial(func, *args, **kwargs), timeout))
+
+    async def _run_once(self, label, func, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, func)
+        started = time.perf_counter()
+        self.in_flight[label] += 1
+        try:
+            # タイムアウトしてもスレッドの処理は止まらないので、終わるまで追えるようにしておく
+            result = await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self._stragglers.add(future)
+            future.add_done_callback(self._forget_straggler)
+            error = SheetsTimeout(f"スプレッドシートの応答がタイムアウトしました ({label})")
+            record_sheets_call(label, time.perf_counter() - started, error)
+            raise error from None
+        except Exception as e:
+            record_sheets_call(label, time.perf_counter() - started, e)
+            raise
+        finally:
+            self.in_flight[label] -= 1
+            if not self.in_flight[label]:
+                del self.in_flight[label]
+        record_sheets_call(label, time.perf_counter() - started)
+        return result
+
+    async def call(self, method, *args, timeout=None, **kwargs):
+        """ワークシートのメソッドをワーカースレッドで実行して結果を返す"""
+        if classify(method) != 'read':
+            # 書き込みの前後に始まった読み取りには相乗りさせない
+            self._reads.clear()
+            try:
+                return await self.run_sync(method, self.session.call, method, *args, timeout=timeout, **kwargs)
+            finally:
+                self._reads.clear()
+        return await self._shared_read(method, args, kwargs, timeout)
+
+    async def _shared_read(self, method, args, kwargs, timeout):
+        """同じ読み取りが実行中ならその結果を待ち、なければ実行する
+
+        相乗りがあった時は外側のリストを呼び出しごとに複製して返す
+        （呼び出し側が行を追加しても他に影響しないように）。
+        行のリスト自体は共有するので書き換えないこと。
+        """
+        key = repr((method, args, sorted(kwargs.items())))
+        entry = self._reads.get(key)
+        if entry is not None:
+            cache_requests.labels('sheets_read', 'hit').inc()
+            entry[1] += 1
+        else:
+            cache_requests.labels('sheets_read', 'miss').inc()
+            task = asyncio.get_running_loop().create_task(
+                self.run_sync(method, self.session.call, method, *args, timeout=timeout, **kwargs))
+            # [タスク, 相乗りした数]
+            entry = self._reads[key] = [task, 0]
+            task.add_done_callback(lambda done: self._forget_read(key, done))
+        # 最初の呼び出しが取り消されても、相乗りした呼び出しのために読み取りは続ける
+        result = await asyncio.shield(entry[0])
+        if entry[1] and isinstance(result, list):
+            return list(result)
+        return result
+
+    async def settle(self):
+        """タイムアウトした呼び出しがワーカースレッドで終わるまで待つ"""
+        if self._stragglers:
+            await asyncio.wait(list(self._stragglers))
+
+    def _forget_straggler(self, future):
+        self._stragglers.discard(future)
+        if not future.cancelled():
+            future.exception()  # 誰も待っていなくても「未取得の例外」の警告を出さない
+
+    def _forget_read(self, key, task):
+        entry = self._reads.get(key)
+        if entry is not None and entry[0] is task:
+            del self._reads[key]
+        if not task.cancelled():
+            task.exception()  # 誰も待っていなくても「未取得の例外」の警告を出さない
+
+    async def connect(self):
+        """ワークシートに接続（接続済みなら既存のハンドルを返す）"""
+        return await self.run_sync('connect', self.session.get_worksheet)
+
+    async def get_all_values(self):
+        return await self.call('get_all_values')
+
+    async def row_values(self, row):
+        return await self.call('row_values', row)
+
+    async def append_row(self, values):
+        return await self.call('append_row', values)
+
+    async def append_rows(self, values):
+        return await self.call('append_rows', values)
+
+    async def update_cell(self, row, col, value):
+        return await self.call('update_cell', row, col, value)
+
+    async def update(self, range_name, values):
+        return await self.call('update', range_name, values)
+
+    async def batch_get(self, ranges):
+        return await self.call('batch_get', ranges)
+
+    async def batch_update(self, data, **kwargs):
+        return await self.call('batch_update', data, **kwargs)
+
+    async def clear(self):
+        return await self.call('clear')
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
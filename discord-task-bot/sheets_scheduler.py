@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import time
+
+import gspread
+
+import metrics
+
+# 1分あたりのリクエスト数の上限（0なら制限しない）。Google Sheets APIの既定はユーザーごとに60
+SHEETS_READ_PER_MINUTE = float(os.environ.get('SHEETS_READ_PER_MINUTE', '60'))
+SHEETS_WRITE_PER_MINUTE = float(os.environ.get('SHEETS_WRITE_PER_MINUTE', '60'))
+# 待たずに続けて送れるリクエスト数
+SHEETS_BURST = int(os.environ.get('SHEETS_BURST', '10'))
+# 429/5xxの時に再試行する回数と待ち時間（秒、1回ごとに倍にする）
+SHEETS_MAX_RETRIES = int(os.environ.get('SHEETS_MAX_RETRIES', '5'))
+SHEETS_BACKOFF_BASE = float(os.environ.get('SHEETS_BACKOFF_BASE', '1.0'))
+SHEETS_BACKOFF_MAX = float(os.environ.get('SHEETS_BACKOFF_MAX', '32.0'))
+
+# 優先度（小さいほど先に実行する）
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# 今のタスクのシート呼び出しの優先度（毎朝通知などの定期処理はBACKGROUNDにする）
+request_priority = contextvars.ContextVar('request_priority', default=INTERACTIVE)
+
+# 読み取りとして数えるメソッド（それ以外は書き込み）
+READ_METHODS = frozenset({
+    'get_all_values', 'row_values', 'col_values', 'batch_get', 'get', 'acell', 'cell',
+    'open_by_key', 'worksheet', 'worksheets',
+})
+# 数えないもの（認証・接続はSheets APIの上限の対象外）
+UNMETERED_METHODS = frozenset({'authorize', 'connect'})
+# 5xxの時に実際には書き込まれている可能性があるので、429の時しか再試行しないもの
+NON_IDEMPOTENT_METHODS = frozenset({'append_row', 'append_rows', 'add_worksheet'})
+
+
+def set_background():
+    """今のタスクのシート呼び出しを後回しにする（定期処理の先頭で呼ぶ）"""
+    request_priority.set(BACKGROUND)
+
+
+class TokenBucket:
+    """1秒あたりrate個ずつ、capacity個まで貯まるトークン"""
+
+    def __init__(self, per_minute, capacity):
+        self.rate = per_minute / 60
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """トークンを1つ使う（足りなければFalse）"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def give_back(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def drain(self):
+        """429が返ってきた時に貯まっている分を捨てる（しばらく間を空ける）"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+    def delay(self):
+        """次のトークンが貯まるまでの秒数"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RequestScheduler:
+    """シートへのリクエストを上限に合わせて順番に流すスケジューラー
+
+    読み取りと書き込みで別々のトークンバケットを持ち、トークンがなければ
+    エラーにせず待たせる。待っている間は対話的なコマンドを定期処理より
+    先に通す（同じ優先度なら来た順）。429や5xxが返ってきたら
+    ゆらぎを入れた指数バックオフで再試行する。
+    """
+
+    def __init__(self, read_per_minute=SHEETS_READ_PER_MINUTE, write_per_minute=SHEETS_WRITE_PER_MINUTE,
+                 burst=SHEETS_BURST, max_retries=SHEETS_MAX_RETRIES,
+                 backoff_base=SHEETS_BACKOFF_BASE, backoff_max=SHEETS_BACKOFF_MAX):
+        self.buckets = {}
+        for kind, per_minute in (('read', read_per_minute), ('write', write_per_minute)):
+            if per_minute > 0:
+                self.buckets[kind] = TokenBucket(per_minute, max(1, burst))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # kind → 待っている呼び出しのヒープ (優先度, 順番, future)
+        self._waiters = {kind: [] for kind in self.buckets}
+        self._timers = {}
+        self._order = itertools.count()
+
+    async def run(self, label, call):
+        """上限に合わせてcall()（コルーチンを返す関数）を実行し、429/5xxなら再試行する"""
+        kind = classify(label)
+        for attempt in itertools.count():
+            await self.acquire(kind)
+            try:
+                return await call()
+            except gspread.exceptions.APIError as e:
+                delay = self.retry_delay(label, e, attempt)
+                if delay is None:
+                    raise
+                if _status(e) == 429 and kind in self.buckets:
+                    self.buckets[kind].drain()
+                metrics.sheets_call_retries.labels(label, _status(e)).inc()
+                print(f"⏳ スプレッドシートが混み合っています（{label}: {_status(e)}）。{delay:.1f}秒後に再試行します")
+                await asyncio.sleep(delay)
+
+    async def acquire(self, kind):
+        """トークンを1つ取る（なければ優先度順に待つ）"""
+        bucket = self.buckets.get(kind)
+        if bucket is None:
+            return
+        waiters = self._waiters[kind]
+        if not waiters and bucket.take():
+            metrics.sheets_queue_wait.labels(kind).observe(0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(waiters, (request_priority.get(), next(self._order), future))
+        metrics.sheets_queue_waiting.labels(kind).set(len(waiters))
+        started = time.perf_counter()
+        self._dispatch(kind)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # トークンを受け取った直後に取り消されたら返しておく
+            if future.done() and not future.cancelled():
+                bucket.give_back()
+            future.cancel()
+            self._dispatch(kind)
+            raise
+        metrics.sheets_queue_wait.labels(kind).observe(time.perf_counter() - started)
+
+    def retry_delay(self, label, error, attempt):
+        """再試行までの秒数（再試行しないならNone）"""
+        status = _status(error)
+        if attempt >= self.max_retries:
+            return None
+        if status != 429 and not (500 <= status < 600 and label not in NON_IDEMPOTENT_METHODS):
+            return None
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # full jitter: 0〜base×2^attempt のどこか
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _dispatch(self, kind):
+        """トークンがある分だけ待っている呼び出しを起こし、残りがあればタイマーを掛ける"""
+        bucket = self.buckets[kind]
+        waiters = self._waiters[kind]
+        while waiters:
+            future = waiters[0][2]
+            if future.done():
+                heapq.heappop(waiters)
+                continue
+            if not bucket.take():
+                break
+            heapq.heappop(waiters)
+            future.set_result(None)
+        metrics.sheets_queue_waiting.labels(kind).set(len(waiters))
+
+        timer = self._timers.pop(kind, None)
+        if timer is not None:
+            timer.cancel()
+        if waiters:
+            loop = asyncio.get_running_loop()
+            self._timers[kind] = loop.call_later(bucket.delay(), self._dispatch, kind)
+
+
+def classify(label):
+    """呼び出しをread / write / None（数えない）に分ける"""
+    if label in UNMETERED_METHODS:
+        return None
+    return 'read' if label in READ_METHODS else 'write'
+
+
+def _status(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', 0) or 0
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+from requests.exceptions import ConnectionError as RequestsConnectionError, ConnectTimeout, Timeout
+
+from sheets_scheduler import NON_IDEMPOTENT_METHODS
+
+SCOPE = [
+    'https://spreadsheets.google.com/feeds',
+    'https://www.googleapis.com/auth/drive'
+]
+HEADER = ['タスク名', '作成日', '完了', '完了日', 'ユーザーID', 'ユーザー名', '期限']
+
+# アクセストークンの期限が切れる何秒前に更新するか
+TOKEN_REFRESH_MARGIN = int(os.environ.get('SHEETS_TOKEN_REFRESH_MARGIN', '300'))
+# 1リクエストあたりのHTTPタイムアウト（秒）
+SHEETS_HTTP_TIMEOUT = float(os.environ.get('SHEETS_HTTP_TIMEOUT', '20'))
+
+
+class SheetsUnavailable(Exception):
+    """スプレッドシートに接続できない"""
+
+
+class SheetsSession:
+    """プロセス全体で共有するGoogle Sheets接続
+
+    認証・スプレッドシート・ワークシートの取得は初回だけ行い、
+    以降はワークシートのハンドルを使い回す。トークンは期限前に更新し、
+    認証切れや通信エラーの時は一度だけ再接続してやり直す。
+    """
+
+    def __init__(self, spreadsheet_id, sheet_name, refresh_margin=TOKEN_REFRESH_MARGIN,
+                 http_timeout=SHEETS_HTTP_TIMEOUT):
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.http_timeout = http_timeout
+        self.client = None
+        self.spreadsheet = None
+        self.worksheet = None
+        self._lock = threading.RLock()
+
+    def get_worksheet(self):
+        """ワークシートを返す（未接続なら接続、トークン期限が近ければ更新）"""
+        with self._lock:
+            if self.worksheet is None:
+                self._connect()
+            elif self._token_expiring():
+                self._refresh_token()
+            return self.worksheet
+
+    def call(self, method, *args, **kwargs):
+        """ワークシートのメソッドを呼ぶ（認証切れ・通信エラー時は再接続して一度だけ再試行）
+
+        追記などの同じ内容を2回送ると重複するメソッドは、リクエストが
+        送られていないと分かる時（認証切れ・接続タイムアウト）だけ再試行する。
+        """
+        sheet = self.get_worksheet()
+        if sheet is None:
+            raise SheetsUnavailable("スプレッドシートに接続できません")
+        try:
+            return getattr(sheet, method)(*args, **kwargs)
+        except (gspread.exceptions.APIError, RequestsConnectionError, Timeout) as e:
+            if not self._should_reconnect(e, method):
+                raise
+            print(f"🔄 スプレッドシートに再接続します: {e}")
+            self.reset()
+            sheet = self.get_worksheet()
+            if sheet is None:
+                raise SheetsUnavailable("スプレッドシートに再接続できません") from e
+            return getattr(sheet, method)(*args, **kwargs)
+
+    def reset(self):
+        """接続を破棄する（次回アクセス時に再接続）"""
+        with self._lock:
+            self.client = None
+            self.spreadsheet = None
+            self.worksheet = None
+
+    def _should_reconnect(self, error, method):
+        if isinstance(error, gspread.exceptions.APIError):
+            return error.response.status_code == 401
+        if method in NON_IDEMPOTENT_METHODS:
+            # 読み取りタイムアウトや切断は、Google側で反映済みのことがある
+            return isinstance(error, ConnectTimeout)
+        return True
+
+    def _token_expiring(self):
+        auth = getattr(self.client, 'auth', None)
+        expiry = getattr(auth, 'expiry', None)
+        if expiry is None:
+            # まだトークン未取得（最初のリクエスト時に自動取得される）
+            return False
+        return datetime.utcnow() >= expiry - self.refresh_margin
+
+    def _refresh_token(self):
+        try:
+            self.client.login()
+            print("🔑 Googleアクセストークンを更新しました")
+        except Exception as e:
+            print(f"⚠️ トークン更新エラー、再接続します: {e}")
+            self.reset()
+            self._connect()
+
+    def _connect(self):
+        # 環境変数チェック
+        credentials_json = os.environ.get('GOOGLE_SERVICE_KEY')
+        if not credentials_json:
+            print("❌ GOOGLE_SERVICE_KEY環境変数が見つかりません")
+            return
+
+        if not self.spreadsheet_id:
+            print("❌ SPREADSHEET_ID環境変数が見つかりません")
+            return
+
+        # JSON解析
+        try:
+            credentials_dict = json.loads(credentials_json)
+        except json.JSONDecodeError as e:
+            print(f"❌ Google認証JSON解析エラー: {e}")
+            return
+
+        # 認証情報作成
+        try:
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict, SCOPE)
+            client = gspread.authorize(creds)
+            client.set_timeout(self.http_timeout)
+        except Exception as e:
+            print(f"❌ Google認証エラー: {e}")
+            return
+
+        # スプレッドシート接続
+        try:
+            spreadsheet = client.open_by_key(self.spreadsheet_id)
+            print(f"✅ スプレッドシート接続成功: {spreadsheet.title}")
+        except Exception as e:
+            print(f"❌ スプレッドシート接続エラー: {e}")
+            print(f"   SPREADSHEET_ID: {self.spreadsheet_id}")
+            return
+
+        # ワークシート取得
+        try:
+            sheet = spreadsheet.worksheet(self.sheet_name)
+            print(f"✅ ワークシート接続成功: {self.sheet_name}")
+        except gspread.WorksheetNotFound:
+            print(f"❌ ワークシート '{self.sheet_name}' が見つかりません")
+            print(f"   利用可能なシート: {[ws.title for ws in spreadsheet.worksheets()]}")
+            # tasksシートがない場合は作成
+            try:
+                sheet = spreadsheet.add_worksheet(title=self.sheet_name, rows=1000, cols=10)
+                # 新しいヘッダー（期限フィールド追加）
+                sheet.append_row(HEADER)
+                print(f"✅ ワークシート '{self.sheet_name}' を作成しました")
+            except Exception as create_error:
+                print(f"❌ ワークシート作成エラー: {create_error}")
+                return
+        except Exception as e:
+            print(f"❌ ワークシート取得エラー: {e}")
+            return
+
+        self.client = client
+        self.spreadsheet = spreadsheet
+        self.worksheet = sheet
@@ -0,0 +1,319 @@
+import asyncio
+import os
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from append_queue import APPEND_SPOOL_PATH, AppendQueue
+from sheets_session import HEADER
+from task_model import pad_row, same_task
+
+# タスクの保存先（sheets: Googleスプレッドシート / sqlite: ローカルのSQLite）
+TASK_STORAGE = os.environ.get('TASK_STORAGE', 'sheets')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'tasks.db')
+# sqlite使用時にスプレッドシートへ非同期でミラーするか
+SQLITE_SHEETS_MIRROR = os.environ.get('SQLITE_SHEETS_MIRROR', 'true').lower() in ('1', 'true', 'yes')
+# 差分読み込みの方式（incremental: 差分のみ / full: 毎回シート全体）
+TASK_SYNC_MODE = os.environ.get('TASK_SYNC_MODE', 'incremental')
+# 差分読み込みで未完了行の完了列を個別に読む範囲数の上限（超えたらまとめて読む）
+SYNC_MAX_RANGES = 100
+
+# 差分読み込みの結果
+#   completions: [(行番号, [完了, 完了日]), ...]
+#   new_rows: 他から追記された行（insert_at行目の後ろに入る）
+SyncChanges = namedtuple('SyncChanges', ['completions', 'new_rows', 'insert_at'])
+
+
+class TaskStorage:
+    """タスクの保存先のインターフェース
+
+    行はシートと同じ形式（ヘッダー行 + 7列の文字列リスト）で受け渡し、
+    行番号はシート上の行番号（ヘッダーが1行目）とする。
+    差分読み込みだけはメモリ上の Task のリストと突き合わせる。
+    """
+
+    # 外部から書き換えられうるか（TrueならTTLごとに読み直す）
+    external_writes = False
+    # スプレッドシートを使うか（起動時のヘッダーチェック用）
+    uses_sheets = False
+
+    def start(self):
+        """バックグラウンド処理を開始（on_readyから呼ぶ）"""
+
+    async def close(self):
+        """書き込み待ちを書き出してバックグラウンド処理を止める（使わなくなった保存先用）"""
+
+    async def load(self):
+        """ヘッダーを含む全行を返す"""
+        raise NotImplementedError
+
+    async def fetch_changes(self, header, tasks):
+        """ヘッダーとtasks（2行目以降）との差分を返す。書き換えられていて差分にできない時はNone"""
+        return SyncChanges([], [], len(tasks) + 1)
+
+    async def append(self, rows):
+        """行を末尾に追加"""
+        raise NotImplementedError
+
+    async def flush(self):
+        """書き込み待ちの行を書き込み、前回から書き込んだ行の位置 [(先頭の行番号, 行), ...] を返す"""
+        return []
+
+    async def complete(self, row_numbers, completed_at):
+        """指定行を完了済みにする"""
+        raise NotImplementedError
+
+    async def replace_all(self, values):
+        """全体をvalues（ヘッダーを含む）で置き換える"""
+        raise NotImplementedError
+
+
+class SheetsStorage(TaskStorage):
+    """Googleスプレッドシートに保存する（追加はAppendQueueでまとめて書き込む）"""
+
+    external_writes = True
+    uses_sheets = True
+
+    def __init__(self, gateway, appends, sync_mode=TASK_SYNC_MODE):
+        self.gateway = gateway
+        self.appends = appends
+        self.sync_mode = sync_mode
+
+    def start(self):
+        # 前回起動時に書き込めなかったタスクがあれば書き込む
+        self.appends.start()
+
+    async def close(self):
+        await self.appends.close()
+
+    async def load(self):
+        # 読み込み中に書き込まれると行が重複・欠落するので止めておく
+        async with self.appends.paused():
+            values = await self.gateway.get_all_values()
+            self.appends.set_sheet_rows(len(values))
+            values.extend(self.appends.pending_rows())
+            # 読み直した行番号が正しいので、それまでに書き込んだ位置は要らない
+            self.appends.take_landed()
+        return values
+
+    async def fetch_changes(self, header, tasks):
+        """新しい行と未完了行の完了列だけを読む
+
+        シートが追記のみで変わっている前提で、ヘッダーか既知の最終行が
+        変わっていたら書き換えられたとみなしてNoneを返す。
+        """
+        if self.sync_mode != 'incremental':
+            return None
+        async with self.appends.paused():
+            known = len(tasks) + 1 - len(self.appends)  # シートにあるはずの行数（ヘッダー含む）
+            if known < 2:
+                return None
+            completion_ranges = _pending_completion_ranges(tasks, known)
+            result = await self.gateway.batch_get(
+                ['A1:G1', f'A{known}:G'] + [f'C{start}:D{end}' for start, end in completion_ranges]
+            )
+            self.appends.set_sheet_rows(known - 1 + len(result[1]))
+        sheet_header, tail = result[0], result[1]
+        if (not sheet_header or pad_row(sheet_header[0]) != header
+                or not tail or not same_task(pad_row(tail[0]), tasks[known - 2].to_row())):
+            return None
+
+        completions = []
+        for (start, _end), cells in zip(completion_ranges, result[2:]):
+            for offset, cell in enumerate(cells):
+                completions.append((start + offset, pad_row(cell, 2)))
+        # 末尾の既知行の完了状態もここで反映
+        completions.append((known, pad_row(tail[0])[2:4]))
+        # 他から追記された行はキュー内の行より前に入る
+        return SyncChanges(completions, [pad_row(row) for row in tail[1:]], known)
+
+    async def append(self, rows):
+        self.appends.put_many(rows)
+
+    async def flush(self):
+        await self.appends.flush()
+        return self.appends.take_landed()
+
+    async def complete(self, row_numbers, completed_at):
+        # まだキューにある行は先に書き込んでおかないと行番号がずれる
+        await self.appends.flush()
+        # update_cellと同じくUSER_ENTEREDで書き込む（TRUEや日付として解釈される）
+        await self.gateway.batch_update([
+            {'range': f'C{row_number}:D{row_number}', 'values': [['TRUE', completed_at]]}
+            for row_number in row_numbers
+        ], value_input_option='USER_ENTERED')
+
+    async def replace_all(self, values):
+        async with self.appends.paused():
+            # キュー内の行もvaluesに含まれているので、書き換えで一緒に反映される
+            await self.gateway.clear()
+            await self.gateway.update('A1', values)
+            self.appends.discard_pending()
+            self.appends.set_sheet_rows(len(values))
+
+
+class SQLiteStorage(TaskStorage):
+    """ローカルのSQLiteに保存する
+
+    行番号をそのまま主キーにしてシートと同じ並びを保つので、
+    スプレッドシートを非同期のミラーとして追従させられる。
+    ミラーへの書き込みは順番を守ってバックグラウンドで行い、失敗しても
+    コマンドは止めない。DBが空の時は初回にミラーから取り込む。
+    """
+
+    def __init__(self, path=SQLITE_PATH, mirror=None):
+        self.path = path
+        self.mirror = mirror
+        self.uses_sheets = mirror is not None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._conn = None
+        self._mirror_task = None
+
+    def start(self):
+        if self.mirror:
+            self.mirror.start()
+
+    async def close(self):
+        if self._mirror_task:
+            await asyncio.wait([self._mirror_task])
+        if self.mirror:
+            await self.mirror.close()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    row INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    created TEXT NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    completed_at TEXT NOT NULL DEFAULT '',
+                    user_id TEXT NOT NULL,
+                    user_name TEXT NOT NULL,
+                    due_date TEXT NOT NULL DEFAULT ''
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_user_done_due ON tasks (user_id, done, due_date)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _select_all(self):
+        cursor = self._connect().execute(
+            "SELECT name, created, done, completed_at, user_id, user_name, due_date FROM tasks ORDER BY row"
+        )
+        return [list(HEADER)] + [_from_db(record) for record in cursor]
+
+    def _insert(self, rows, first_row):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO tasks (row, name, created, done, completed_at, user_id, user_name, due_date)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(first_row + i,) + _to_db(row) for i, row in enumerate(rows)]
+            )
+
+    def _next_row(self):
+        (last_row,) = self._connect().execute("SELECT COALESCE(MAX(row), 1) FROM tasks").fetchone()
+        return last_row + 1
+
+    def _append(self, rows):
+        self._insert(rows, self._next_row())
+
+    def _complete(self, row_numbers, completed_at):
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE tasks SET done = 1, completed_at = ? WHERE row = ?",
+                [(completed_at, row_number) for row_number in row_numbers]
+            )
+
+    def _replace_all(self, values):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM tasks")
+            conn.executemany(
+                "INSERT INTO tasks (row, name, created, done, completed_at, user_id, user_name, due_date)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(row_number,) + _to_db(row) for row_number, row in enumerate(values[1:], start=2)]
+            )
+
+    async def load(self):
+        values = await self._run(self._select_all)
+        if len(values) <= 1 and self.mirror:
+            # 初回はスプレッドシートの内容を取り込む
+            sheet_values = await self.mirror.load()
+            if len(sheet_values) > 1:
+                await self._run(self._insert, [pad_row(row) for row in sheet_values[1:]], 2)
+                print(f"📥 スプレッドシートから{len(sheet_values) - 1}件をSQLiteに取り込みました")
+                values = await self._run(self._select_all)
+        return values
+
+    async def append(self, rows):
+        await self._run(self._append, rows)
+        self._mirror_write(self.mirror.append if self.mirror else None, rows)
+
+    async def complete(self, row_numbers, completed_at):
+        await self._run(self._complete, row_numbers, completed_at)
+        self._mirror_write(self.mirror.complete if self.mirror else None, row_numbers, completed_at)
+
+    async def replace_all(self, values):
+        await self._run(self._replace_all, values)
+        self._mirror_write(self.mirror.replace_all if self.mirror else None, values)
+
+    def _mirror_write(self, func, *args):
+        """ミラーへの書き込みを前の書き込みの後ろにつなげて実行する"""
+        if func is None:
+            return
+        previous = self._mirror_task
+
+        async def run():
+            if previous:
+                await asyncio.wait([previous])
+            try:
+                await func(*args)
+            except Exception as e:
+                print(f"❌ スプレッドシートへのミラーエラー: {e}")
+
+        self._mirror_task = asyncio.get_running_loop().create_task(run())
+
+
+def create_storage(gateway, spool_path=APPEND_SPOOL_PATH, sqlite_path=SQLITE_PATH):
+    """環境変数 TASK_STORAGE に応じた保存先を作る"""
+    sheets_storage = SheetsStorage(gateway, AppendQueue(gateway, spool_path=spool_path))
+    if TASK_STORAGE == 'sqlite':
+        return SQLiteStorage(sqlite_path, mirror=sheets_storage if SQLITE_SHEETS_MIRROR else None)
+    return sheets_storage
+
+
+def _pending_completion_ranges(tasks, known):
+    """シート上の未完了行（known行目より前）を連続した範囲にまとめる"""
+    ranges = []
+    for task in tasks[:known - 2]:
+        if task.done:
+            continue
+        row_number = task.row
+        if ranges and ranges[-1][1] == row_number - 1:
+            ranges[-1][1] = row_number
+        else:
+            ranges.append([row_number, row_number])
+    if len(ranges) > SYNC_MAX_RANGES:
+        return [(ranges[0][0], ranges[-1][1])]
+    return [tuple(r) for r in ranges]
+
+
+def _to_db(row):
+    row = pad_row(row)
+    return (row[0], row[1], 1 if row[2] == 'TRUE' else 0, row[3], row[4], row[5], row[6])
+
+
+def _from_db(record):
+    name, created, done, completed_at, user_id, user_name, due_date = record
+    return [name, created, 'TRUE' if done else 'FALSE', completed_at, user_id, user_name, due_date]
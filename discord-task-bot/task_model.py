@@ -0,0 +1,229 @@
+import bisect
+import sys
+import unicodedata
+from datetime import date
+
+from due_dates import parse_stored_date
+
+ROW_WIDTH = 7
+# 行の同一性チェックに使う列（完了・完了日以外）
+IDENTITY_COLUMNS = (0, 1, 4, 5, 6)
+
+
+def pad_row(row, width=ROW_WIDTH):
+    row = list(row)
+    if len(row) < width:
+        row.extend([''] * (width - len(row)))
+    return row
+
+
+def same_task(a, b):
+    """完了状態を除いて同じタスクの行か"""
+    return all(a[i] == b[i] for i in IDENTITY_COLUMNS)
+
+
+class Task:
+    """タスク1行分（シートの7列に対応）
+
+    行ごとに辞書や文字列のリストを持つとタスク数が多い時にメモリを
+    圧迫するので、__slots__ で属性を固定している。
+    ユーザーID・ユーザー名は sys.intern して同じ文字列を共有する。
+    期限は比較用の due_date（解釈できなければNone）と、書き戻し用に
+    シート上の文字列 due_text の両方を持つ。
+    """
+
+    __slots__ = ('row', 'name', 'created', 'done', 'completed_at', 'user_id', 'user_name', 'due_text', 'due_date')
+
+    def __init__(self, row, name, created, done, completed_at, user_id, user_name, due_text, due_date):
+        self.row = row
+        self.name = name
+        self.created = created
+        self.done = done
+        self.completed_at = completed_at
+        self.user_id = user_id
+        self.user_name = user_name
+        self.due_text = due_text
+        self.due_date = due_date
+
+    @classmethod
+    def from_row(cls, row_number, row):
+        """シートの1行（文字列のリスト）から作る"""
+        return cls(
+            row_number,
+            row[0],
+            row[1],
+            row[2] == 'TRUE',
+            row[3],
+            sys.intern(row[4]),
+            sys.intern(row[5]),
+            row[6],
+            parse_stored_date(row[6])
+        )
+
+    def to_row(self):
+        """シートに書き込む形式（文字列のリスト）に戻す"""
+        return [
+            self.name,
+            self.created,
+            'TRUE' if self.done else 'FALSE',
+            self.completed_at,
+            self.user_id,
+            self.user_name,
+            self.due_text
+        ]
+
+    def __repr__(self):
+        return f'Task(row={self.row}, name={self.name!r}, done={self.done}, due_date={self.due_date})'
+
+
+class TaskColumns:
+    """未完了タスクを拾うための完了フラグの列（i番目が行番号i+2のタスク、1なら完了）"""
+
+    __slots__ = ('done',)
+
+    def __init__(self):
+        self.done = bytearray()
+
+    @classmethod
+    def from_tasks(cls, tasks):
+        columns = cls()
+        for task in tasks:
+            columns.append(task)
+        return columns
+
+    def append(self, task):
+        self.done.append(1 if task.done else 0)
+
+    def set_done(self, index, done):
+        self.done[index] = 1 if done else 0
+
+    def __len__(self):
+        return len(self.done)
+
+
+class DueBuckets:
+    """期限のある未完了タスクを期限日ごとのバケツに分けて持つ
+
+    バケツのキーは日付の序数で、キーの一覧を昇順に並べておくので
+    「期限切れ」「今日まで」「3日以内」は範囲の検索になり、
+    該当するタスクの数だけの処理で済む。
+    キーは今日からの日数ではなく日付そのものなので、日付が変わっても
+    作り直す必要はない（問い合わせ側が新しい「今日」で範囲を引くだけ）。
+    """
+
+    __slots__ = ('_days', '_buckets')
+
+    def __init__(self):
+        self._days = []
+        self._buckets = {}  # 日付の序数 → {Task: None}（追加順を保つ集合として使う）
+
+    @classmethod
+    def from_tasks(cls, tasks):
+        buckets = cls()
+        for task in tasks:
+            buckets.add(task)
+        return buckets
+
+    def add(self, task):
+        if task.due_date is None:
+            return
+        day = task.due_date.toordinal()
+        bucket = self._buckets.get(day)
+        if bucket is None:
+            bucket = self._buckets[day] = {}
+            bisect.insort(self._days, day)
+        bucket[task] = None
+
+    def remove(self, task):
+        if task.due_date is None:
+            return
+        day = task.due_date.toordinal()
+        bucket = self._buckets.get(day)
+        if bucket is None or task not in bucket:
+            return
+        del bucket[task]
+        if not bucket:
+            del self._buckets[day]
+            del self._days[bisect.bisect_left(self._days, day)]
+
+    def between(self, first=None, last=None):
+        """期限がfirst〜last（両端を含む、Noneなら制限なし）のタスクを期限順で返す"""
+        days = self._days
+        lo = bisect.bisect_left(days, first.toordinal()) if first else 0
+        hi = bisect.bisect_right(days, last.toordinal()) if last else len(days)
+        result = []
+        for day in days[lo:hi]:
+            result.extend(self._buckets[day])
+        return result
+
+
+class NamePrefixIndex:
+    """1ユーザーの未完了タスクをタスク名の前方一致で引く索引
+
+    スラッシュコマンドの入力補完は数秒以内に応答しないといけないので、
+    正規化したタスク名の昇順のリストを持っておき二分探索で引く。
+    タスクの追加・完了に合わせて差分だけ更新する。
+    """
+
+    __slots__ = ('_keys', '_tasks')
+
+    def __init__(self):
+        self._keys = []  # (正規化したタスク名, 行番号) の昇順
+        self._tasks = []  # _keysと同じ順のタスク
+
+    @classmethod
+    def from_tasks(cls, tasks):
+        index = cls()
+        entries = sorted(((name_key(task.name), task.row), task) for task in tasks)
+        index._keys = [key for key, _task in entries]
+        index._tasks = [task for _key, task in entries]
+        return index
+
+    def add(self, task):
+        key = (name_key(task.name), task.row)
+        i = bisect.bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        self._tasks.insert(i, task)
+
+    def remove(self, task):
+        key = (name_key(task.name), task.row)
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._tasks[i] is task:
+            del self._keys[i]
+            del self._tasks[i]
+
+    def search(self, text, limit=25):
+        """名前がtextで始まるタスクを名前順に返す（足りなければtextを含むものも）"""
+        prefix = name_key(text)
+        keys = self._keys
+        result = []
+        i = bisect.bisect_left(keys, (prefix,))
+        while i < len(keys) and len(result) < limit and keys[i][0].startswith(prefix):
+            result.append(self._tasks[i])
+            i += 1
+        if prefix and len(result) < limit:
+            found = set(map(id, result))
+            for (name, _row), task in zip(keys, self._tasks):
+                if prefix in name and id(task) not in found:
+                    result.append(task)
+                    if len(result) >= limit:
+                        break
+        return result
+
+    def __len__(self):
+        return len(self._tasks)
+
+
+# カタカナ → ひらがな
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def name_key(name):
+    """検索用にタスク名を正規化する（全角・半角、大文字・小文字、カタカナ・ひらがなを区別しない）"""
+    return unicodedata.normalize('NFKC', name).casefold().translate(_KATAKANA_TO_HIRAGANA)
+
+
+def due_sort_key(task):
+    # 期限の早い順、期限なしは最後。同じ期限ならシート上の順
+    due_date = task.due_date
+    return (due_date is None, due_date or date.max, task.row)
@@ -0,0 +1,142 @@
+import os
+
+import discord
+
+from discord_limits import EMBED_DESCRIPTION_MAX, MESSAGE_MAX_CHARS, truncate
+from due_dates import format_due_date
+from task_model import due_sort_key
+
+# !tasks の1ページのタスク数
+TASKS_PER_PAGE = 5
+# !alltasks の1ページの行数（ユーザー名の行を含む）
+ALLTASKS_LINES_PER_PAGE = 20
+# ボタンを押せる時間（秒）。過ぎたらボタンを無効にする
+PAGE_VIEW_TIMEOUT = float(os.environ.get('PAGE_VIEW_TIMEOUT', '300'))
+
+
+class PagedView(discord.ui.View):
+    """前へ/次へボタンでページを切り替えるビュー
+
+    コマンドを実行した時点のタスクの一覧を持っておき、表示するページだけを
+    その都度作る。タスクが何件あっても最初のページはすぐに送れる。
+    ボタンを押せるのはコマンドを実行した本人だけ。
+    """
+
+    def __init__(self, author_id, page_count, timeout=PAGE_VIEW_TIMEOUT):
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.page_count = page_count
+        self.page = 0
+        self.message = None
+        self._update_buttons()
+
+    def render(self, page):
+        """ページの内容（ctx.sendに渡すキーワード引数）を返す"""
+        raise NotImplementedError
+
+    async def send(self, ctx):
+        """最初のページを送る（1ページしかなければボタンは付けない）"""
+        if self.page_count <= 1:
+            self.stop()
+            return await ctx.send(**self.render(0))
+        self.message = await ctx.send(**self.render(0), view=self)
+        return self.message
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("❌ コマンドを実行した人だけがページを切り替えられます", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label='◀ 前へ', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label='1/1', style=discord.ButtonStyle.secondary, disabled=True)
+    async def page_label(self, interaction, button):
+        pass
+
+    @discord.ui.button(label='次へ ▶', style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction, button):
+        await self._show(interaction, self.page + 1)
+
+    async def _show(self, interaction, page):
+        self.page = max(0, min(page, self.page_count - 1))
+        self._update_buttons()
+        await interaction.response.edit_message(**self.render(self.page), view=self)
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+        self.page_label.label = f"{self.page + 1}/{self.page_count}"
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+
+class TaskListView(PagedView):
+    """!tasks のページ（1ページ5件の埋め込み、番号は!completeと同じ）"""
+
+    def __init__(self, author, tasks):
+        super().__init__(author.id, -(-len(tasks) // TASKS_PER_PAGE))
+        self.display_name = author.display_name
+        self.tasks = tasks
+
+    def render(self, page):
+        embed = discord.Embed(
+            title=f"📋 {self.display_name}さんのタスク ({page + 1}/{self.page_count})",
+            color=0x3498db
+        )
+
+        task_list = ""
+        start = page * TASKS_PER_PAGE
+        for i, task in enumerate(self.tasks[start:start + TASKS_PER_PAGE], start + 1):
+            due_info = format_due_date(task.due_date)
+            task_list += f"**{i}.** {task.name}\n"
+            task_list += f"　📅 {due_info}\n"
+            task_list += f"　📝 作成: {task.created}\n\n"
+
+        embed.description = truncate(task_list, EMBED_DESCRIPTION_MAX)
+        embed.set_footer(text="完了: !complete [番号] | 例: !complete 1")
+        return {'embed': embed}
+
+
+class AllTasksView(PagedView):
+    """!alltasks のページ（ユーザーごとに期限順、1ページ20行）"""
+
+    def __init__(self, author_id, pending):
+        user_tasks = {}
+        for task in pending:
+            user_tasks.setdefault(task.user_name, []).append(task)
+
+        # 行の一覧: (ユーザー名, 件数, タスク) 。タスクがNoneならユーザー名の行
+        self.lines = []
+        for user_name, tasks in user_tasks.items():
+            # 各ユーザーのタスクを!tasksと同じ期限順にソート（期限切れも日付順）
+            tasks.sort(key=due_sort_key)
+            self.lines.append((user_name, len(tasks), None))
+            self.lines.extend((user_name, len(tasks), task) for task in tasks)
+        super().__init__(author_id, -(-len(self.lines) // ALLTASKS_LINES_PER_PAGE))
+
+    def render(self, page):
+        title = "📊 **全体タスク状況**" if page == 0 else "📊 **全体タスク状況（続き）**"
+        message = f"{title} ({page + 1}/{self.page_count})\n"
+
+        start = page * ALLTASKS_LINES_PER_PAGE
+        lines = self.lines[start:start + ALLTASKS_LINES_PER_PAGE]
+        user_name, count, task = lines[0]
+        if task is not None:
+            # 前のページから続いているユーザー
+            message += f"\n**{user_name}さん ({count}件・続き):**\n"
+        for user_name, count, task in lines:
+            if task is None:
+                message += f"\n**{user_name}さん ({count}件):**\n"
+            else:
+                message += f"• {task.name} - {format_due_date(task.due_date)}\n"
+        return {'content': truncate(message, MESSAGE_MAX_CHARS)}
@@ -0,0 +1,342 @@
+import asyncio
+import bisect
+import os
+import time
+from datetime import timedelta
+
+from metrics import cache_requests
+from sheets_session import HEADER
+from task_model import DueBuckets, NamePrefixIndex, Task, TaskColumns, due_sort_key, pad_row, same_task
+
+# キャッシュの有効期限（秒）。0なら明示的に無効化するまで再読込しない
+TASK_CACHE_TTL = float(os.environ.get('TASK_CACHE_TTL', '300'))
+
+
+class TaskTable:
+    """タスク全体のメモリ上のコピー
+
+    初回アクセス時に保存先から全体を読み込み、以降の読み取りはメモリから返す。
+    追加・完了・削除は保存先に書き込んだ後、同じ内容をメモリにも反映する
+    （ライトスルー）。invalidate() されると次回読み込み直す。
+    保存先が外部から書き換えられうる場合（スプレッドシート）は、TTLを過ぎると
+    差分を読み込んで追従する。
+
+    タスクは行ごとに Task（__slots__付き）で持ち、未完了タスクを拾うために
+    完了フラグだけを並べた TaskColumns も持つ。
+    ユーザーIDごとに未完了タスクの索引を期限順で持っており、
+    個人向けのコマンドはそのユーザーのタスク数だけの処理で済む。
+    期限のある未完了タスクは期限日ごとのバケツ（DueBuckets）にも入れてあり、
+    期限切れ・緊急の集計は該当するタスクだけを見る。
+    統計用にユーザーごとの総数・完了数を追加・完了のたびに数え直さずに更新し、
+    日付に依存する期限切れ・緊急の数は日付が変わった時だけ数え直す。
+    """
+
+    def __init__(self, storage, ttl=TASK_CACHE_TTL):
+        self.storage = storage
+        self.ttl = ttl
+        self.version = 0
+        self._header = list(HEADER)
+        self._tasks = None  # i番目がシートのi+2行目
+        self._columns = TaskColumns()
+        self._pending_by_user = {}
+        self._due = DueBuckets()
+        self._names = {}  # ユーザーID → NamePrefixIndex（入力補完で使われたユーザーの分だけ）
+        self._counts = {}  # ユーザー名 → [総数, 完了数]
+        self._completed_count = 0
+        self._due_counts = None  # (数えた日付, {ユーザー名: [期限切れ数, 緊急数]})
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """キャッシュを破棄する（次回アクセス時に保存先から再読込）"""
+        self._tasks = None
+
+    def _is_fresh(self):
+        if self._tasks is None:
+            return False
+        if not self.storage.external_writes or not self.ttl:
+            return True
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    async def ensure_fresh(self):
+        """未読込・期限切れなら保存先から読み込む"""
+        if self._is_fresh():
+            cache_requests.labels('task_table', 'hit').inc()
+            return
+        async with self._lock:
+            if self._is_fresh():
+                cache_requests.labels('task_table', 'hit').inc()
+            elif self._tasks is None:
+                cache_requests.labels('task_table', 'miss').inc()
+                await self._load()
+            else:
+                cache_requests.labels('task_table', 'sync').inc()
+                await self._sync()
+
+    async def pending(self):
+        """未完了タスクをシート上の順で返す"""
+        await self.ensure_fresh()
+        tasks, done = self._tasks, self._columns.done
+        result = []
+        # 完了フラグの列から未完了（0）の位置だけを拾う
+        index = done.find(0)
+        while index != -1:
+            result.append(tasks[index])
+            index = done.find(0, index + 1)
+        return result
+
+    async def pending_tasks(self, user_id):
+        """ユーザーの未完了タスクを期限順（期限なしは最後）で返す"""
+        await self.ensure_fresh()
+        return self._pending_by_user.get(user_id, [])
+
+    def name_index(self, user_id):
+        """ユーザーの未完了タスクの名前の索引（未読込ならNone）
+
+        入力補完から呼ぶので保存先には問い合わせず、今メモリにある内容で答える。
+        """
+        if self._tasks is None:
+            return None
+        names = self._names.get(user_id)
+        if names is None:
+            names = self._names[user_id] = NamePrefixIndex.from_tasks(self._pending_by_user.get(user_id, []))
+        return names
+
+    async def pending_due(self, user_id, last, first=None):
+        """ユーザーの未完了タスクのうち、期限がfirst〜last（両端を含む）のものを期限順で返す
+
+        firstがNoneなら期限切れのものも含める。
+        """
+        await self.ensure_fresh()
+        user_tasks = self._pending_by_user.get(user_id, [])
+        # 索引は期限順なので二分探索で範囲を切り出す
+        lo = bisect.bisect_left(user_tasks, (False, first, 0), key=due_sort_key) if first else 0
+        hi = bisect.bisect_right(user_tasks, (False, last, float('inf')), key=due_sort_key)
+        return user_tasks[lo:hi]
+
+    async def stats(self, today):
+        """統計用の集計を返す
+
+        戻り値: ({ユーザー名: [総数, 完了数]}, {ユーザー名: [期限切れ数, 緊急数]})
+        どちらも呼び出し側で書き換えないこと。
+        """
+        await self.ensure_fresh()
+        if self._due_counts is None or self._due_counts[0] != today:
+            # 日付が変わったら3日後までが期限のタスクだけ数え直す
+            self._due_counts = (today, {})
+            for task in self._due.between(None, today + timedelta(days=3)):
+                self._count_due(task, 1)
+        return self._counts, self._due_counts[1]
+
+    @property
+    def task_count(self):
+        """ヘッダーを除いた行数"""
+        return len(self._tasks) if self._tasks else 0
+
+    @property
+    def completed_count(self):
+        """完了済みの行数"""
+        return self._completed_count if self._tasks else 0
+
+    async def _load(self):
+        values = await self.storage.load()
+        if values:
+            self._header = pad_row(values[0])
+        self._set_tasks([Task.from_row(row_number, pad_row(row))
+                         for row_number, row in enumerate(values[1:], start=2)])
+
+    async def _sync(self):
+        changes = await self.storage.fetch_changes(self._header, self._tasks)
+        if changes is None:
+            print("🔄 シートが書き換えられているため全体を読み直します")
+            await self._load()
+            return
+
+        changed = False
+        for row_number, cells in changes.completions:
+            changed |= self._apply_completion(row_number, cells)
+
+        if changes.new_rows:
+            changed = True
+            at = changes.insert_at - 1  # 挿入位置（_tasksの添字）
+            if at < len(self._tasks):
+                # 書き込み待ちの行より前に入るので番号を振り直す
+                rows = [task.to_row() for task in self._tasks]
+                rows[at:at] = changes.new_rows
+                self._set_tasks([Task.from_row(row_number, row)
+                                 for row_number, row in enumerate(rows, start=2)])
+                return
+            for row in changes.new_rows:
+                self._add(row)
+        self._loaded_at = time.monotonic()
+        if changed:
+            self.version += 1
+
+    def _apply_completion(self, row_number, cells):
+        index = row_number - 2
+        task = self._tasks[index]
+        done, completed_at = cells[0] == 'TRUE', cells[1]
+        if task.done == done and task.completed_at == completed_at:
+            return False
+        was_pending = not task.done
+        task.done, task.completed_at = done, completed_at
+        self._columns.set_done(index, done)
+        if was_pending and done:
+            self._count(task, 0, 1)
+            self._index_remove(task)
+        elif not was_pending and not done:
+            self._count(task, 0, -1)
+            self._index_add(task)
+        return True
+
+    def _add(self, row):
+        task = Task.from_row(len(self._tasks) + 2, pad_row(row))
+        self._tasks.append(task)
+        self._columns.append(task)
+        self._count(task, 1, 1 if task.done else 0)
+        if not task.done:
+            self._index_add(task)
+
+    def _set_tasks(self, tasks):
+        self._tasks = tasks
+        self._columns = TaskColumns.from_tasks(tasks)
+        self._loaded_at = time.monotonic()
+        self._counts = {}
+        self._completed_count = 0
+        for task in tasks:
+            self._count(task, 1, 1 if task.done else 0)
+        self._rebuild_index()
+        self.version += 1
+
+    def _rebuild_index(self):
+        self._pending_by_user = {}
+        for task in self._tasks:
+            if not task.done:
+                self._pending_by_user.setdefault(task.user_id, []).append(task)
+        for user_tasks in self._pending_by_user.values():
+            user_tasks.sort(key=due_sort_key)
+        self._due = DueBuckets.from_tasks(task for task in self._tasks if not task.done)
+        self._names = {}
+        self._due_counts = None
+
+    def _count(self, task, total, completed):
+        counts = self._counts.get(task.user_name)
+        if counts is None:
+            counts = self._counts[task.user_name] = [0, 0]
+        counts[0] += total
+        counts[1] += completed
+        self._completed_count += completed
+
+    def _count_due(self, task, delta):
+        """期限切れ・緊急の数を更新（数えた日付を基準にする。未集計なら何もしない）"""
+        if self._due_counts is None or task.due_date is None:
+            return
+        day, counts = self._due_counts
+        diff = (task.due_date - day).days
+        if diff > 3:
+            return
+        user_counts = counts.get(task.user_name)
+        if user_counts is None:
+            user_counts = counts[task.user_name] = [0, 0]
+        user_counts[0 if diff < 0 else 1] += delta
+
+    def _index_add(self, task):
+        bisect.insort(self._pending_by_user.setdefault(task.user_id, []), task, key=due_sort_key)
+        self._due.add(task)
+        names = self._names.get(task.user_id)
+        if names is not None:
+            names.add(task)
+        self._count_due(task, 1)
+
+    def _index_remove(self, task):
+        user_tasks = self._pending_by_user.get(task.user_id, [])
+        for i, pending in enumerate(user_tasks):
+            if pending is task:
+                del user_tasks[i]
+                break
+        if not user_tasks:
+            self._pending_by_user.pop(task.user_id, None)
+        self._due.remove(task)
+        names = self._names.get(task.user_id)
+        if names is not None:
+            names.remove(task)
+        self._count_due(task, -1)
+
+    async def append(self, row):
+        """1行追加（保存先に書き込み、メモリにも追加）"""
+        await self.append_many([row])
+
+    async def append_many(self, rows):
+        """複数行をまとめて追加（保存先への書き込みは1回）"""
+        async with self._lock:
+            await self.storage.append(rows)
+            if self._tasks is not None:
+                for row in rows:
+                    self._add(row)
+            self.version += 1
+
+    async def mark_completed_many(self, tasks, completed_at):
+        """複数のタスクをまとめて完了済みにする（1回の書き込みで反映する）
+
+        行番号はロックを取ってから読む（!clearcompletedで振り直されることがあるため）。
+        完了済みにしたタスクを返す（その間に完了・削除されたものは除く）。
+        """
+        if not tasks:
+            return []
+        async with self._lock:
+            landed = await self.storage.flush()
+            if self._tasks is None:
+                await self._load()
+            elif not self._landed_in_place(landed):
+                # 書き込み待ちの間に他から追記されると、その行は想定より後ろに入る
+                print("🔄 追加したタスクの行番号がずれたため全体を読み直します")
+                await self._load()
+            tasks = self._current_pending(tasks)
+            if not tasks:
+                return []
+            await self.storage.complete([task.row for task in tasks], completed_at)
+            for task in tasks:
+                self._apply_completion(task.row, ['TRUE', completed_at])
+            self.version += 1
+            return tasks
+
+    def _landed_in_place(self, landed):
+        """書き込んだ行がメモリ上で振った行番号のとおりに入ったか"""
+        for first_row, rows in landed:
+            if first_row is None:
+                return False
+            for row_number, row in enumerate(rows, start=first_row):
+                index = row_number - 2
+                if not 0 <= index < len(self._tasks) or not same_task(pad_row(row), self._tasks[index].to_row()):
+                    return False
+        return True
+
+    def _current_pending(self, tasks):
+        """tasksのうち今の表でまだ未完了のものを返す（読み直した後は同じ内容の行を探す）"""
+        found = []
+        for task in tasks:
+            index = task.row - 2
+            if 0 <= index < len(self._tasks) and self._tasks[index] is task:
+                if not task.done:
+                    found.append(task)
+                continue
+            row = task.to_row()
+            for candidate in self._tasks:
+                if not candidate.done and candidate not in found and same_task(candidate.to_row(), row):
+                    found.append(candidate)
+                    break
+        return found
+
+    async def clear_completed(self):
+        """完了済みの行を削除して保存先を書き換え、削除した件数を返す"""
+        await self.ensure_fresh()
+        async with self._lock:
+            kept = [task for task in self._tasks if not task.done]
+            removed = len(self._tasks) - len(kept)
+            if removed == 0:
+                return 0
+            await self.storage.replace_all([self._header] + [task.to_row() for task in kept])
+            for row_number, task in enumerate(kept, start=2):
+                task.row = row_number
+            self._set_tasks(kept)
+            return removed
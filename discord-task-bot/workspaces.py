@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import re
+from collections import Counter, OrderedDict, namedtuple
+from contextlib import asynccontextmanager
+
+from append_queue import APPEND_SPOOL_PATH
+from digest import DigestEngine
+from sheets_gateway import SheetsGateway
+from sheets_scheduler import RequestScheduler
+from sheets_session import HEADER, SheetsSession
+from storage import SQLITE_PATH, create_storage
+from task_table import TaskTable
+
+# ギルド・チャンネルごとのスプレッドシート（JSON、チャンネルの指定がギルドより優先）
+#   {"<ギルドIDまたはチャンネルID>": "<スプレッドシートID>", ...}
+#   {"<ギルドIDまたはチャンネルID>": {"spreadsheet_id": "...", "sheet_name": "tasks"}, ...}
+GUILD_SHEETS = os.environ.get('GUILD_SHEETS', '')
+# 同時に開いておくスプレッドシートの数の上限（既定のシートは数えない）
+SHEETS_POOL_SIZE = int(os.environ.get('SHEETS_POOL_SIZE', '8'))
+
+SheetTarget = namedtuple('SheetTarget', ['spreadsheet_id', 'sheet_name'])
+
+
+def parse_routes(text, default_sheet_name):
+    """GUILD_SHEETS を {ギルドIDまたはチャンネルID: SheetTarget} にする"""
+    if not text:
+        return {}
+    routes = {}
+    for key, value in json.loads(text).items():
+        if isinstance(value, str):
+            value = {'spreadsheet_id': value}
+        routes[int(key)] = SheetTarget(value['spreadsheet_id'], value.get('sheet_name', default_sheet_name))
+    return routes
+
+
+class Workspace:
+    """1つのワークシートの接続・保存先・タスク表・毎朝通知の要約"""
+
+    def __init__(self, target, session, scheduler, spool_path=APPEND_SPOOL_PATH, sqlite_path=SQLITE_PATH):
+        self.target = target
+        self.session = session
+        self.sheets = SheetsGateway(session, scheduler=scheduler)
+        self.storage = create_storage(self.sheets, spool_path=spool_path, sqlite_path=sqlite_path)
+        self.table = TaskTable(self.storage)
+        self.digest = DigestEngine(self.table)
+        self.leases = 0  # 使っているコマンドなどの数（0になるまで閉じない）
+        self._ready = None
+
+    async def prepare(self):
+        """ヘッダーを確認・修正して、書き込み待ちのタスクなどのバックグラウンド処理を開始する"""
+        sheet = await self.sheets.connect() if self.storage.uses_sheets else None
+        if sheet:
+            try:
+                headers = await self.sheets.row_values(1)
+                if not headers or headers[0] != 'タスク名':
+                    await self.sheets.clear()
+                    # 新しいヘッダー（期限フィールド追加）
+                    await self.sheets.append_row(list(HEADER))
+                    print(f"✅ スプレッドシート初期化完了 ({self.target.sheet_name})")
+                elif len(headers) < 7:  # 期限フィールドがない場合は追加
+                    await self.sheets.update_cell(1, 7, '期限')
+                    print(f"✅ 期限フィールドを追加しました ({self.target.sheet_name})")
+                # ヘッダーを書き換えた場合に備えて、次のアクセスで読み込む
+                self.table.invalidate()
+            except Exception as e:
+                print(f"❌ 初期化エラー: {e}")
+        self.storage.start()
+
+    async def ready(self):
+        """初回だけprepare()を実行する（同時に呼ばれても1回、失敗したら次の呼び出しでやり直す）"""
+        if self._ready is None:
+            self._ready = asyncio.get_running_loop().create_task(self.prepare())
+            self._ready.add_done_callback(self._forget_failed_prepare)
+        await asyncio.shield(self._ready)
+
+    def _forget_failed_prepare(self, task):
+        if self._ready is task and (task.cancelled() or task.exception() is not None):
+            self._ready = None
+
+    async def close(self):
+        """書き込み待ちを書き出して接続を閉じる"""
+        await self.storage.close()
+        self.sheets.shutdown()
+
+
+class WorkspacePool:
+    """ギルド・チャンネルごとのWorkspaceを作って使い回す
+
+    GUILD_SHEETS に書かれたギルド・チャンネルはそれぞれのスプレッドシートを、
+    それ以外は既定のスプレッドシートを使う。認証済みの接続とタスク表は
+    ワークシートごとに使い回し、開いている数が上限を超えたら最も長く
+    使われていないものから閉じる（既定のものは閉じない）。
+    使用中のものは追い出しても、使い終わるまで閉じずにおく。
+    Sheets APIの上限はプロジェクト全体で数えられるので、スケジューラーは共有する。
+    """
+
+    def __init__(self, default_target, routes=None, max_size=SHEETS_POOL_SIZE, session_factory=SheetsSession):
+        self.routes = routes or {}
+        self.max_size = max_size
+        self.session_factory = session_factory
+        self.scheduler = RequestScheduler()
+        self.default = Workspace(default_target, session_factory(*default_target), self.scheduler)
+        self._pool = OrderedDict()  # SheetTarget → Workspace（古い順）
+        self._retired = {}  # SheetTarget → 追い出したがまだ使われているWorkspace
+        self._closing = {}  # SheetTarget → 閉じている途中のタスク
+
+    def target_for(self, guild_id=None, channel_id=None):
+        for key in (channel_id, guild_id):
+            if key is not None and key in self.routes:
+                return self.routes[key]
+        return self.default.target
+
+    def cached(self, guild_id=None, channel_id=None):
+        """開いているWorkspaceを返す（なければNone、接続はしない）"""
+        target = self.target_for(guild_id, channel_id)
+        if target == self.default.target:
+            return self.default
+        return self._pool.get(target) or self._retired.get(target)
+
+    async def get(self, guild_id=None, channel_id=None, ready=True):
+        """ギルド・チャンネルのWorkspaceを返す
+
+        readyなら初めて使う時に接続してヘッダーを確認する（シートの修復時はFalse）。
+        返したWorkspaceは今のタスクが終わるまで閉じない（コマンドは1回ごとに
+        別のタスクで実行されるので、コマンドが終わるまで）。
+        """
+        workspace = await self._acquire(self.target_for(guild_id, channel_id), ready)
+        if workspace is not self.default:
+            asyncio.current_task().add_done_callback(lambda _task: self._release(workspace))
+        return workspace
+
+    async def for_context(self, ctx, ready=True):
+        """コマンドを実行したギルド・チャンネルのWorkspace"""
+        guild = getattr(ctx, 'guild', None)
+        channel = getattr(ctx, 'channel', None)
+        return await self.get(guild.id if guild else None, channel.id if channel else None, ready=ready)
+
+    @asynccontextmanager
+    async def lease(self, guild_id=None, channel_id=None, ready=True):
+        """ブロックの中にいる間は閉じないWorkspaceを貸す（定期処理など長く続くタスク用）"""
+        workspace = await self._acquire(self.target_for(guild_id, channel_id), ready)
+        try:
+            yield workspace
+        finally:
+            self._release(workspace)
+
+    def all(self):
+        return [self.default] + list(self._pool.values()) + list(self._retired.values())
+
+    def in_flight(self):
+        """全Workspaceで実行中のシート呼び出し（label → 件数）"""
+        calls = Counter()
+        for workspace in self.all():
+            calls.update(workspace.sheets.in_flight)
+        return calls
+
+    async def _acquire(self, target, ready):
+        if target == self.default.target:
+            workspace = self.default
+        else:
+            workspace = await self._open(target)
+        if ready:
+            try:
+                await workspace.ready()
+            except BaseException:
+                self._release(workspace)
+                raise
+        return workspace
+
+    async def _open(self, target):
+        """targetのWorkspaceを開いて貸す"""
+        while True:
+            workspace = self._pool.get(target)
+            if workspace is not None:
+                self._pool.move_to_end(target)
+                workspace.leases += 1
+                return workspace
+            workspace = self._retired.pop(target, None)
+            if workspace is None:
+                closing = self._closing.get(target)
+                if closing is not None:
+                    # 同じスプール・SQLiteのファイルを使うので、閉じ終わってから開き直す
+                    await asyncio.wait([closing])
+                    continue
+                workspace = Workspace(
+                    target, self.session_factory(*target), self.scheduler,
+                    spool_path=_target_path(APPEND_SPOOL_PATH, target),
+                    sqlite_path=_target_path(SQLITE_PATH, target),
+                )
+            self._pool[target] = workspace
+            # 貸してから追い出すので、開いたばかりのものは閉じない
+            workspace.leases += 1
+            self._evict()
+            return workspace
+
+    def _release(self, workspace):
+        if workspace is self.default:
+            return
+        workspace.leases -= 1
+        target = workspace.target
+        if workspace.leases == 0 and self._retired.get(target) is workspace:
+            del self._retired[target]
+            self._close(workspace)
+
+    def _evict(self):
+        while len(self._pool) > self.max_size:
+            target, workspace = self._pool.popitem(last=False)
+            print(f"📕 使われていないスプレッドシートを閉じます ({target.spreadsheet_id}/{target.sheet_name})")
+            if workspace.leases:
+                # 使い終わったら閉じる
+                self._retired[target] = workspace
+            else:
+                self._close(workspace)
+
+    def _close(self, workspace):
+        target = workspace.target
+        task = asyncio.get_running_loop().create_task(workspace.close())
+        # 閉じ終わるまで参照を持っておく（同じシートを開き直す時はこれを待つ）
+        self._closing[target] = task
+        task.add_done_callback(self._forget_closing)
+
+    def _forget_closing(self, task):
+        for target, closing in list(self._closing.items()):
+            if closing is task:
+                del self._closing[target]
+
+
+def _target_path(path, target):
+    """既定のファイル名にスプレッドシートを区別する部分を付ける（空なら空のまま）"""
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    suffix = re.sub(r'[^\w-]', '_', f"{target.spreadsheet_id}.{target.sheet_name}")
+    return f"{root}.{suffix}{ext}"